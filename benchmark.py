@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# Headless: no window and no sound card needed
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+from PIL import Image
+
+from metrics import metrics, percentile
+
+
+BENCHMARKS = ["render", "compose", "session"]
+
+RENDER_METHODS = [
+    "handle_events",
+    "render_camera_frame",
+    "render_static_layer",
+    "render_countdown",
+    "render_confirmation_countdown",
+    "render_progress_bar",
+    "render_generated_image",
+    "render_printer_message",
+    "render_print_status",
+    "render_press_button",
+    "render_press_to_continue",
+    "render_flash_screen",
+    "render_loading_indicator",
+]
+
+
+# Stands in for CameraCapture: a moving gradient at the webcam's frame rate
+class SyntheticCamera:
+    def __init__(self, width=1280, height=720, fps=30, frames=30):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        base = np.dstack(
+            [np.tile(x, (height, 1)), np.tile(y[:, None], (1, width)), np.full((height, width), 128, np.uint8)]
+        )
+        self.frames = [np.roll(base, i * width // frames, axis=1) for i in range(frames)]
+        self.start_time = time.time()
+
+    def start(self):
+        return self
+
+    def latest(self):
+        now = time.time()
+        frame_id = int((now - self.start_time) * self.fps) + 1
+        return frame_id, now, self.frames[frame_id % len(self.frames)]
+
+    def closest(self, timestamp, timeout=0.5):
+        return self.latest()
+
+    def release(self):
+        pass
+
+
+def photo(camera):
+    # Same crop as PhotoBooth.take_photo
+    _, _, frame = camera.latest()
+    height, width, _ = frame.shape
+    size = min(width, height)
+    left, top = (width - size) // 2, (height - size) // 2
+    image = Image.fromarray(frame[top : top + size, left : left + size, ::-1])
+    return image.resize((512, 512))
+
+
+def timings(seconds):
+    seconds = sorted(seconds)
+    return {
+        "count": len(seconds),
+        "mean_ms": sum(seconds) / len(seconds) * 1000,
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p95_ms": percentile(seconds, 95) * 1000,
+        "max_ms": seconds[-1] * 1000,
+    }
+
+
+def stub_worker(steps, step_time):
+    # The real ImageGenerator, with imaginAIry swapped for a CPU stub
+    from generate import ImageGenerator
+    from stub_generator import StubImagineBackend
+    from worker import GenerationWorker
+
+    backend = StubImagineBackend(steps=steps, step_time=step_time)
+    return GenerationWorker(ImageGenerator(warmup=False, backend=backend))
+
+
+def benchmark_render(root, duration, steps, step_time):
+    # Runs the real booth uncapped, pressing the button whenever it waits for
+    # input, so every screen of a session is rendered
+    import pygame
+
+    from main import PhotoBooth
+    from print_backends import FilePrintBackend
+
+    booth = PhotoBooth(
+        print_backend="file",
+        camera=SyntheticCamera(),
+        generation_worker=stub_worker(steps, step_time),
+        sessions_dir=os.path.join(root, "sessions"),
+        print_queue_dir=os.path.join(root, "print_queue"),
+    )
+    booth.printer.backend = FilePrintBackend(os.path.join(root, "prints"))
+
+    method_times = {name: [] for name in RENDER_METHODS + ["flush"]}
+
+    def timed(name, method):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                method_times[name].append(time.perf_counter() - start)
+
+        return wrapper
+
+    for name in RENDER_METHODS:
+        setattr(booth, name, timed(name, getattr(booth, name)))
+    booth.compositor.flush = timed("flush", booth.compositor.flush)
+
+    def press():
+        pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE, mod=0))
+
+    frame_times = []
+    sessions = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        waiting = (
+            booth.current_take == 0
+            and not booth.countdown_enabled
+            and not booth.printer_message_enabled
+        )
+        if waiting:
+            sessions += 1
+            press()
+        elif booth.generated_image_enabled and time.time() - booth.generated_image_time > 1:
+            press()
+        frame_start = time.perf_counter()
+        booth.render_frame()
+        frame_times.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+
+    booth.generation_worker.stop()
+    booth.spooler.stop()
+    booth.images.stop()
+    pygame.quit()
+
+    return {
+        "seconds": elapsed,
+        "frames": len(frame_times),
+        "sessions_started": sessions,
+        "fps": len(frame_times) / elapsed,
+        "frame": timings(frame_times),
+        "methods": {name: timings(times) for name, times in method_times.items() if times},
+    }
+
+
+def benchmark_compose(root, iterations):
+    from imagestore import ImageStore
+    from printer import ImagePrinter
+
+    camera = SyntheticCamera()
+    printer = ImagePrinter(image_store=ImageStore(os.path.join(root, "sessions")))
+    originals = [photo(camera) for _ in range(3)]
+    generated = [image.transpose(Image.Transpose.FLIP_LEFT_RIGHT) for image in originals]
+
+    compose_times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        printer.compose(*originals, *generated)
+        compose_times.append(time.perf_counter() - start)
+
+    # The booth's path: one take pasted at a time, then a copy for printing
+    take_times = []
+    for session in range(iterations):
+        for take in range(1, 4):
+            start = time.perf_counter()
+            printer.add_take(session, take, originals[take - 1], generated[take - 1])
+            take_times.append(time.perf_counter() - start)
+
+    return {"compose": timings(compose_times), "add_take": timings(take_times)}
+
+
+def benchmark_session(root, sessions, steps, step_time):
+    from imagestore import ImageStore
+    from print_backends import FilePrintBackend
+    from printer import ImagePrinter
+    from sessionindex import SessionIndex
+    from spooler import PrintSpooler
+
+    camera = SyntheticCamera()
+    worker = stub_worker(steps, step_time)
+    index = SessionIndex(os.path.join(root, "sessions", "index.db"))
+    # Set up like the booth does, spans go to the temporary sessions/
+    metrics.root = os.path.join(root, "sessions")
+    metrics.index = index
+    store = ImageStore(os.path.join(root, "sessions"), index=index)
+    printer = ImagePrinter(image_store=store, backend=FilePrintBackend(os.path.join(root, "prints")))
+    spooler = PrintSpooler(printer, queue_dir=os.path.join(root, "print_queue"), index=index)
+
+    stages = {"capture": [], "generate": [], "add_take": [], "print": [], "session": []}
+    for _ in range(sessions):
+        session_start = time.perf_counter()
+        session = index.new_session("benchmark")
+        for take in range(1, 4):
+            start = time.perf_counter()
+            image = photo(camera)
+            store.put(session, str(take), image)
+            stages["capture"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            job = worker.submit(image, name=f"{session}/{take}")
+            job.wait()
+            if job.error:
+                raise job.error
+            stages["generate"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            printer.add_take(session, take, image, job.result)
+            stages["add_take"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        print_job = spooler.submit(session)
+        print_job.wait()
+        stages["print"].append(time.perf_counter() - start)
+        stages["session"].append(time.perf_counter() - session_start)
+
+    worker.stop()
+    spooler.stop()
+    store.stop()
+    metrics.flush()
+    metrics.index = None
+    index.close()
+    return {
+        "sessions": sessions,
+        "generator": {"steps": steps, "step_time": step_time},
+        "stages": {stage: timings(times) for stage, times in stages.items()},
+    }
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def compare(results, baseline, tolerance):
+    # Times (_ms) should not go up, rates (fps) should not go down
+    regressions = []
+    previous = dict(flatten(baseline["results"]))
+    for name, value in flatten(results["results"]):
+        before = previous.get(name)
+        if not before:
+            continue
+        if name.endswith("_ms") and value > before * (1 + tolerance):
+            regressions.append((name, before, value))
+        elif name.endswith("fps") and value < before * (1 - tolerance):
+            regressions.append((name, before, value))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the booth's render, compose and session paths")
+    parser.add_argument(
+        "benchmarks", nargs="*", help="render, compose or session, all of them if none are given"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of render loop to run")
+    parser.add_argument("--iterations", type=int, default=50, help="Compose runs")
+    parser.add_argument("--sessions", type=int, default=3, help="End-to-end sessions to run")
+    parser.add_argument("--steps", type=int, default=30, help="Steps of the stub imaginAIry backend")
+    parser.add_argument("--step-time", type=float, default=0.01, help="Stub backend seconds per step")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.15, help="Allowed slowdown against the baseline"
+    )
+    args = parser.parse_args()
+    # Checked here, argparse rejects an empty list against choices
+    for benchmark in args.benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error(f"unknown benchmark {benchmark!r}, choose from {', '.join(BENCHMARKS)}")
+    args.benchmarks = args.benchmarks or BENCHMARKS
+
+    with tempfile.TemporaryDirectory(prefix="photobooth-benchmark-") as root:
+        results = {
+            "time": time.time(),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": {},
+        }
+        for benchmark in args.benchmarks:
+            print(f"Running {benchmark} benchmark...", file=sys.stderr)
+            if benchmark == "render":
+                result = benchmark_render(root, args.duration, args.steps, args.step_time)
+            elif benchmark == "compose":
+                result = benchmark_compose(root, args.iterations)
+            else:
+                result = benchmark_session(root, args.sessions, args.steps, args.step_time)
+            results["results"][benchmark] = result
+        metrics.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"Regression: {name} {before:.2f} -> {after:.2f}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import cv2
+import threading
+import time
+from collections import deque
+
+
+class CameraCapture:
+    def __init__(self, index=0, width=1280, height=720, fps=30, buffer_size=8):
+        self.cap = cv2.VideoCapture(
+            index, cv2.CAP_DSHOW
+        )  # makes it load faster in Windows. Most likely no needed in Mac / Linux?
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.cap.set(cv2.CAP_PROP_FPS, fps)
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+        # Ring buffer of (frame_id, timestamp, frame), newest last
+        self.frames = deque(maxlen=buffer_size)
+        self.frame_id = 0
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def _capture_loop(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            timestamp = time.time()
+            if not ret:
+                # Driver hiccup, back off a bit instead of spinning
+                time.sleep(0.01)
+                continue
+            with self.new_frame:
+                self.frame_id += 1
+                self.frames.append((self.frame_id, timestamp, frame))
+                self.new_frame.notify_all()
+
+    def latest(self):
+        with self.lock:
+            if not self.frames:
+                return 0, None, None
+            return self.frames[-1]
+
+    def closest(self, timestamp, timeout=0.5):
+        # The buffered frame nearest to the shutter time, without waiting for
+        # a newer one, so the UI thread never blocks on the camera. Only waits
+        # if nothing has been captured yet.
+        with self.new_frame:
+            if not self.frames:
+                self.new_frame.wait_for(lambda: self.frames, timeout)
+            if not self.frames:
+                return 0, None, None
+            return min(self.frames, key=lambda entry: abs(entry[1] - timestamp))
+
+    def release(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        self.cap.release()
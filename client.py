@@ -0,0 +1,130 @@
+import io
+import socket
+import threading
+
+from PIL import Image
+
+from protocol import (
+    DEFAULT_HOST,
+    DEFAULT_PORT,
+    decode_image,
+    encode_image,
+    read_message,
+    send_message,
+)
+from worker import GenerationJob, GenerationProgress
+
+
+# Same interface as GenerationWorker, but generations run in server.py
+class GenerationClient:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=300, booth=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # The server schedules booths fairly by this name, or by address
+        self.booth = booth
+        # Jobs queued on the server across all booths, as last reported
+        self.queue_depth = None
+        # The server loads and warms up the model before it accepts jobs
+        self.loading_progress = GenerationProgress()
+        self.ready_time = None
+        self.load_error = None
+
+    def is_ready(self):
+        return True
+
+    def submit(
+        self, image, forced_prompt=None, on_progress=None, name=None, booth=None, waiting=False
+    ):
+        job = GenerationJob(image, forced_prompt, on_progress, name, booth or self.booth, waiting)
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+
+    def _run(self, job):
+        # Started once the server takes the job off its queue, so time spent
+        # behind other booths' jobs counts as queue time
+        if not job.set_running(started=False):
+            return
+        try:
+            if isinstance(job.image, str):
+                with open(job.image, "rb") as f:
+                    image = f.read()
+            else:
+                # The network is the one place an encode can't be avoided
+                buffer = io.BytesIO()
+                job.image.save(buffer, "JPEG", quality=95)
+                image = buffer.getvalue()
+
+            with socket.create_connection((self.host, self.port), self.timeout) as sock:
+                stream = sock.makefile("rwb")
+                send_lock = threading.Lock()
+
+                def send(message):
+                    with send_lock:
+                        send_message(stream, message)
+
+                def send_waiting(job):
+                    try:
+                        send({"type": "waiting", "id": 1})
+                    except OSError:
+                        pass  # The result or error shows up in the read loop
+
+                def send_cancel(job):
+                    # Right away, so a job still queued on the server never
+                    # runs and stops counting against other booths
+                    try:
+                        send({"type": "cancel", "id": 1})
+                    except OSError:
+                        pass
+
+                waiting_sent = job.waiting
+                send(
+                    {
+                        "type": "submit",
+                        "id": 1,
+                        "image": encode_image(image),
+                        "prompt": job.forced_prompt,
+                        "booth": job.booth,
+                        "waiting": waiting_sent,
+                    },
+                )
+                job.on_waiting = send_waiting
+                if job.waiting and not waiting_sent:
+                    send_waiting(job)
+                job.on_cancel = send_cancel
+                if job.cancelled():
+                    send_cancel(job)  # Cancelled before the hook was set
+                queued = False
+                while True:
+                    message = read_message(stream)
+                    if message is None:
+                        raise ConnectionError("Generation server closed the connection")
+                    if message["type"] == "cancelled":
+                        return
+                    if message["type"] == "queue":
+                        self.queue_depth = message["depth"]
+                        job.queue_position = message["positions"].get("1")
+                        if job.queue_position is not None:
+                            queued = True
+                        elif queued:
+                            job.set_started()  # The server's worker picked it up
+                    elif message["type"] == "progress":
+                        job.set_started()
+                        job.update_progress(GenerationProgress(**message["progress"]))
+                    elif message["type"] == "result":
+                        job.set_started()  # Cached results never report progress
+                        result = Image.open(io.BytesIO(decode_image(message["image"])))
+                        result.load()
+                        for key in ["prompt", "caption"]:
+                            if message.get(key):
+                                result.info[key] = message[key]
+                        job.set_result(result)
+                        return
+                    elif message["type"] == "error":
+                        raise RuntimeError(message["error"])
+        except Exception as e:
+            print(f"Error: Generation failed for {job.name}: {e}")
+            job.set_error(e)
+
+    def stop(self):
+        pass
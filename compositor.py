@@ -0,0 +1,71 @@
+import pygame
+
+
+class LayerCompositor:
+    def __init__(self, screen):
+        self.screen = screen
+        self.static_layers = {}
+        self.active_key = None
+        self.full_redraw = True
+        # Rects drawn over the static chrome this frame and the one before
+        self.overlay_rects = []
+        self.previous_overlay_rects = []
+        self.update_rects = []
+
+    def reset(self, screen):
+        # Called whenever the display size changes, every layer is rebuilt lazily
+        self.screen = screen
+        self.static_layers.clear()
+        self.active_key = None
+        self.full_redraw = True
+        self.overlay_rects = []
+        self.previous_overlay_rects = []
+        self.update_rects = []
+
+    def static_layer(self, key, build):
+        layer = self.static_layers.get(key)
+        if layer is None:
+            layer = pygame.Surface(self.screen.get_size()).convert()
+            build(layer)
+            self.static_layers[key] = layer
+        return layer
+
+    def draw_static(self, key, build, regions):
+        layer = self.static_layer(key, build)
+        regions = [pygame.Rect(region) for region in regions]
+
+        if self.full_redraw or key != self.active_key:
+            self.active_key = key
+            for region in regions:
+                self.screen.blit(layer, region, region)
+                self.update_rects.append(region)
+            return
+
+        # Only restore the parts of the chrome that overlays drew on last frame
+        for rect in self.previous_overlay_rects:
+            for region in regions:
+                clipped = rect.clip(region)
+                if clipped.width and clipped.height:
+                    self.screen.blit(layer, clipped, clipped)
+
+    def mark(self, rect):
+        rect = pygame.Rect(rect).clip(self.screen.get_rect())
+        if rect.width and rect.height:
+            self.overlay_rects.append(rect)
+
+    def mark_static(self, rect):
+        # Changed this frame, but drawn over by something that repaints it anyway
+        self.update_rects.append(pygame.Rect(rect))
+
+    def flush(self):
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            # Areas drawn on last frame must be pushed too, or they never get erased
+            pygame.display.update(
+                self.update_rects + self.overlay_rects + self.previous_overlay_rects
+            )
+        self.previous_overlay_rects = self.overlay_rects
+        self.overlay_rects = []
+        self.update_rects = []
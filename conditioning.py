@@ -0,0 +1,79 @@
+import threading
+import time
+
+
+# imaginAIry encodes the prompt and negative prompt with the text encoder on
+# every generation. The booth only ever uses a fixed catalog of prompts, so the
+# embeddings are memoized by wrapping imaginAIry's encoding helper, and the
+# whole catalog is encoded once right after warmup.
+class ConditioningCache:
+    def __init__(self):
+        self.embeddings = {}
+        self.encode_seconds = {}
+        self.lock = threading.Lock()
+        self.text_encoder = None
+        self.installed = False
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0
+
+    def install(self):
+        if self.installed:
+            return True
+        try:
+            from imaginairy.api import generate_refiners
+        except ImportError as e:
+            print(f"Warning: Conditioning cache disabled: {e}")
+            return False
+        original = getattr(generate_refiners, "_prompts_to_embeddings", None)
+        if original is None:
+            print("Warning: Conditioning cache disabled, imaginAIry has no _prompts_to_embeddings")
+            return False
+
+        def prompts_to_embeddings(prompts, text_encoder):
+            return self.encode(original, prompts, text_encoder)
+
+        generate_refiners._prompts_to_embeddings = prompts_to_embeddings
+        self.installed = True
+        return True
+
+    def encode(self, original, prompts, text_encoder):
+        key = (
+            tuple((prompt.text, prompt.weight) for prompt in prompts),
+            id(text_encoder),
+            str(getattr(text_encoder, "device", "")),
+        )
+        with self.lock:
+            self.text_encoder = text_encoder
+            embedding = self.embeddings.get(key)
+            if embedding is not None:
+                self.hits += 1
+                self.saved_seconds += self.encode_seconds[key]
+                return embedding
+
+        start = time.perf_counter()
+        embedding = original(prompts, text_encoder)
+        with self.lock:
+            self.misses += 1
+            self.embeddings[key] = embedding
+            self.encode_seconds[key] = time.perf_counter() - start
+        return embedding
+
+    def precompute(self, imagine_prompts):
+        # Needs the text encoder, which imaginAIry only loads on the first run
+        if not self.installed or self.text_encoder is None:
+            return
+        from imaginairy.api import generate_refiners
+
+        for imagine_prompt in imagine_prompts:
+            for prompts in [imagine_prompt.prompts, imagine_prompt.negative_prompt]:
+                generate_refiners._prompts_to_embeddings(prompts, self.text_encoder)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.embeddings),
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_seconds": self.saved_seconds,
+            }
@@ -0,0 +1,84 @@
+import json
+import os
+import statistics
+import threading
+import time
+
+from fileutils import write_atomic
+from worker import GenerationJob, GenerationProgress
+
+
+# Learns how long generations take from the last few finished jobs: the time
+# until the first step, the time per denoising step and the time from the last
+# step to the result. Kept in a JSON file, so estimates are good right after a
+# restart too.
+class EtaEstimator:
+    def __init__(self, path=os.path.join("sessions", "eta.json"), window=20):
+        self.path = path
+        self.window = window
+        self.lock = threading.Lock()
+        self.history = {"start": [], "step": [], "finish": [], "steps": []}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                history = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read {self.path}: {e}")
+            return
+        for name in self.history:
+            self.history[name] = history.get(name, [])[-self.window :]
+
+    def _save(self):
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(self.history, f)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_atomic(self.path, write)
+
+    def observe(self, job):
+        # Cached results and failed jobs never ran a step, they teach nothing
+        if job.status != GenerationJob.DONE or job.first_step_time is None:
+            return
+        steps = job.progress.step
+        samples = {
+            "start": job.first_step_time - job.started_time,
+            "finish": job.finished_time - job.last_step_time,
+            "steps": steps,
+        }
+        if steps > 1:
+            samples["step"] = (job.last_step_time - job.first_step_time) / (steps - 1)
+        with self.lock:
+            for name, value in samples.items():
+                self.history[name] = (self.history[name] + [value])[-self.window :]
+            try:
+                self._save()
+            except OSError as e:
+                print(f"Warning: Could not save {self.path}: {e}")
+
+    def remaining(self, job, now=None):
+        # Seconds until the job's result is in, None until a job has been seen
+        with self.lock:
+            if not self.history["step"]:
+                return None
+            start, step, finish, steps = (
+                statistics.median(self.history[name])
+                for name in ["start", "step", "finish", "steps"]
+            )
+        now = now or time.time()
+        progress = job.progress
+        total = progress.total or steps
+
+        if progress.phase == GenerationProgress.FINISH:
+            return max(0, finish - (now - job.last_step_time))
+        if progress.phase == GenerationProgress.DENOISE:
+            left = (total - progress.step) * step + finish
+            return max(0, left - (now - job.last_step_time))
+        waiting = start if job.started_time is None else max(0, start - (now - job.started_time))
+        return waiting + total * step + finish
@@ -0,0 +1,15 @@
+import os
+
+
+def write_atomic(filename, write):
+    # Readers never see a half written file, only the old one or the new one.
+    # The extension is kept on the temp file so PIL and OpenCV pick the format.
+    root, ext = os.path.splitext(filename)
+    temp_filename = f"{root}.tmp{ext}"
+    try:
+        write(temp_filename)
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
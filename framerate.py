@@ -0,0 +1,66 @@
+import time
+from collections import deque
+
+
+# Caps the render loop at a target frame rate per mode. The time left in each
+# frame is slept away, which releases the GIL for the camera and generation
+# threads instead of redrawing the same picture as fast as possible.
+class FrameGovernor:
+    PREVIEW = "preview"  # Live camera preview and animations
+    BUSY = "busy"  # A generation is running, the screen shows a held frame
+    IDLE = "idle"  # Nobody has used the booth for a while
+
+    def __init__(self, fps=30, busy_fps=10, idle_fps=15, window=300):
+        self.targets = {self.PREVIEW: fps, self.BUSY: busy_fps, self.IDLE: idle_fps}
+        self.mode = self.PREVIEW
+        self.deadline = None
+        self.frame_start = None
+        self.frame_times = deque(maxlen=window)  # (seconds, target seconds)
+        self.work_times = deque(maxlen=window)
+
+    def tick(self, mode=PREVIEW):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.work_times.append(now - self.frame_start)
+
+        interval = 1 / self.targets[mode]
+        if self.deadline is None or mode != self.mode or now - self.deadline > interval:
+            # First frame, a mode change or a frame that ran long: start over
+            # rather than rushing to catch up
+            self.deadline = now + interval
+        else:
+            self.deadline += interval
+        self.mode = mode
+        # sleep(0) still yields when the frame used up all of its time
+        time.sleep(max(0, self.deadline - time.perf_counter()))
+
+        end = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.append((end - self.frame_start, interval))
+        self.frame_start = end
+
+    def stats(self):
+        if not self.frame_times:
+            return None
+        times = [seconds for seconds, _ in self.frame_times]
+        mean = sum(times) / len(times)
+        # Jitter is how far frames land from their target, on average
+        jitter = sum(abs(seconds - target) for seconds, target in self.frame_times) / len(times)
+        return {
+            "mode": self.mode,
+            "fps": 1 / mean,
+            "frame_ms": mean * 1000,
+            "max_frame_ms": max(times) * 1000,
+            "work_ms": sum(self.work_times) / len(self.work_times) * 1000,
+            "jitter_ms": jitter * 1000,
+        }
+
+    def report(self):
+        stats = self.stats()
+        if stats is None:
+            return "Frames: no frames yet"
+        return (
+            f"Frames ({stats['mode']}): {stats['fps']:.1f} fps, "
+            f"frame {stats['frame_ms']:.1f} ms (max {stats['max_frame_ms']:.1f} ms, "
+            f"work {stats['work_ms']:.1f} ms), jitter {stats['jitter_ms']:.2f} ms"
+        )
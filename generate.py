@@ -1,10 +1,76 @@
 import sys
-from imaginairy.api.generate import imagine, imagine_image_files
-from imaginairy.schema import ImaginePrompt, ControlInput, LazyLoadingImage, MaskMode
 
+# imaginAIry pulls in torch and friends, so it is only imported once a
+# generation actually runs
 
+import argparse
+import glob
+import itertools
+import os
 import random
 import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from conditioning import ConditioningCache
+from fileutils import write_atomic
+from resultcache import ResultCache
+from worker import GenerationCancelled, GenerationProgress
+
+
+class PreprocessedImage:
+    def __init__(self, image, depth_map=None, face_mask=None):
+        self.image = image
+        self.depth_map = depth_map
+        self.face_mask = face_mask
+
+
+# Everything ImageGenerator takes from imaginAIry. Imported on first use, and
+# swapped for stub_generator.StubImagineBackend to run the generator without
+# a GPU.
+class ImaginairyBackend:
+    def load(self):
+        # The slowest import by far, torch comes with it
+        import imaginairy.api.generate  # noqa: F401
+
+    def schema(self):
+        # ImaginePrompt, ControlInput and MaskMode
+        from imaginairy import schema
+
+        return schema
+
+    def imagine(self, prompts, debug_img_callback):
+        from imaginairy.api.generate import imagine
+
+        return imagine(prompts=prompts, debug_img_callback=debug_img_callback)
+
+    def install_conditioning(self, conditioning):
+        return conditioning.install()
+
+    def create_depth_map(self, image):
+        # Same steps imaginAIry takes for a depth ControlInput
+        import torch
+        from imaginairy.img_processors.control_modes import CONTROL_MODES
+        from imaginairy.utils import get_device
+        from imaginairy.utils.img_utils import (
+            pillow_fit_image_within,
+            pillow_img_to_torch_image,
+            torch_img_to_pillow_img,
+        )
+
+        image = pillow_fit_image_within(image.convert("RGB"), max_height=512, max_width=512)
+        image_t = pillow_img_to_torch_image(image).to(get_device())
+        with torch.no_grad():
+            depth_t = CONTROL_MODES["depth"](image_t)
+        # image_raw is read back as (t + 1) / 2, so it is stored in the -1..1 range
+        return torch_img_to_pillow_img(depth_t * 2 - 1)
+
+    def create_face_mask(self, image, mask_prompt):
+        from imaginairy.enhancers.clip_masking import get_img_mask
+
+        face_mask, _ = get_img_mask(image, mask_prompt, threshold=0.1)
+        return face_mask
 
 
 class ImageGenerator:
@@ -79,16 +145,86 @@ class ImageGenerator:
         },
     ]
 
-    already_used_prompts = set()
+    mask_prompt = "(female face OR male face OR person face OR face OR hair){-2}"
+
+    negative_prompt = "deformed hands, too many fingers, weird fingers, wrong fingers, weird hands, malformed, strange, ugly, duplication, duplicates, mutilation, deformed, mutilated, mutation, twisted body, disfigured, bad anatomy, out of frame, extra fingers, mutated hands, poorly drawn hands, extra limbs, malformed limbs, missing arms, extra arms, missing legs, extra legs, mutated hands, extra hands, fused fingers, missing fingers, extra fingers, long neck, small head, closed eyes, rolling eyes, weird eyes, smudged face, blurred face, poorly drawn face, mutation, mutilation, cloned face, strange mouth, grainy, blurred, blurry, writing, calligraphy, signature, text, watermark, bad art"
+
+    # Share of the warmup bar for each phase of loading, in percent
+    loading_phases = {
+        "import": (0, 10),
+        "weights": (10, 40),
+        "warmup": (40, 90),
+        "conditioning": (90, 100),
+    }
+
+    def __init__(self, warmup=True, callback=None, cache=None, backend=None):
+        self.already_used_prompts = set()
+        self.backend = backend or ImaginairyBackend()
+        # Optional ResultCache, the fixed seed makes generations repeatable
+        self.cache = cache
+        self.conditioning = ConditioningCache()
+        if warmup:
+            # Loads the model and runs one full pass, callback gets a LOADING
+            # GenerationProgress as every phase of the load starts and for
+            # each warmup step.
+            # Skips the cache, a cached result wouldn't warm anything up.
+            def report(phase, fraction=0):
+                if callback:
+                    start, end = self.loading_phases[phase]
+                    callback(
+                        GenerationProgress(
+                            start + (end - start) * fraction, 100, GenerationProgress.LOADING
+                        )
+                    )
 
-    def __init__(self, warmup=True):
-        if warmup:            
-            self.generate("logo.png", "AI Tinkerers")
+            def warmup_step(progress):
+                report("warmup", progress.fraction())
 
-    def generate(self, filename, forced_prompt=None, callback=None):
+            report("import")
+            self.backend.load()
+
+            # The weights load in the first imagine() call, before its first step
+            report("weights")
+            self.generate_batch(
+                [("logo.png", "AI Tinkerers", warmup_step, None)], use_cache=False
+            )
+            report("conditioning")
+            self.precompute_conditioning()
+            report("conditioning", 1)
+
+    def full_prompt(self, prompt):
+        return ", ".join([prompt, "high quality, no text"])
+
+    def precompute_conditioning(self):
+        schema = self.backend.schema()
+
+        start = time.perf_counter()
+        self.conditioning.precompute(
+            [
+                schema.ImaginePrompt(
+                    prompt=self.full_prompt(prompt["prompt"]),
+                    negative_prompt=self.negative_prompt,
+                )
+                for prompt in self.prompts
+            ]
+        )
+        print(f"Encoded {len(self.prompts)} prompts in {time.perf_counter() - start:.2f}s")
+
+    def generate(self, image, forced_prompt=None, callback=None, token=None):
+        result = self.generate_batch([(image, forced_prompt, callback, token)])[0]
+        if result is None:
+            raise GenerationCancelled()
+        return result
+
+    def preprocess(self, image):
+        # Everything that only depends on the photo, so it can run as soon as
+        # the photo is taken instead of inside the generation
         from PIL import Image
 
-        image = Image.open(filename)
+        if isinstance(image, PreprocessedImage):
+            return image
+        if isinstance(image, str):
+            image = Image.open(image)
         width, height = image.size
         new_size = min(width, height)
         left = (width - new_size) / 2
@@ -97,60 +233,387 @@ class ImageGenerator:
         bottom = (height + new_size) / 2
         image = image.crop((left, top, right, bottom))
         image.thumbnail((512, 512))
-        control_mode_depth = ControlInput(mode="depth", image=image, strength=0.5)
-        control_mode_openpose = ControlInput(mode="openpose", image=image, strength=0.2)
-        control_mode_canny = ControlInput(mode="canny", image=image, strength=0.2)
-        control_mode_edit = ControlInput(mode="edit", image=image, strength=0.5)
-
-        prompt = (
-            {"caption": forced_prompt, "prompt": forced_prompt}
-            if forced_prompt
-            else random.choice(self.prompts)
-        )
 
-        if len(self.already_used_prompts) == len(self.prompts):
-            self.already_used_prompts.clear()
+        depth_map = None
+        face_mask = None
+        try:
+            depth_map = self.backend.create_depth_map(image)
+        except Exception as e:
+            print(f"Warning: Depth map will be computed during generation: {e}")
+        try:
+            face_mask = self.backend.create_face_mask(image, self.mask_prompt)
+        except Exception as e:
+            print(f"Warning: Face mask will be computed during generation: {e}")
+        return PreprocessedImage(image, depth_map, face_mask)
+
+    def prepare(self, image, forced_prompt=None):
+        schema = self.backend.schema()
+
+        preprocessed = self.preprocess(image)
+        image = preprocessed.image
+
+        if forced_prompt:
+            # Forced prompts are used every time and don't count against the
+            # catalog rotation
+            prompt = {"caption": forced_prompt, "prompt": forced_prompt}
+        else:
+            if len(self.already_used_prompts) == len(self.prompts):
+                self.already_used_prompts.clear()
 
-        while prompt["prompt"] in self.already_used_prompts:
             prompt = random.choice(self.prompts)
-        self.already_used_prompts.add(prompt["prompt"])
+            while prompt["prompt"] in self.already_used_prompts:
+                prompt = random.choice(self.prompts)
+            self.already_used_prompts.add(prompt["prompt"])
 
         # caption = generate_caption(image)
 
         # prompt = self.prompts[0]
 
-        print(", ".join([prompt["prompt"], "high quality, no text"]))
+        print(self.full_prompt(prompt["prompt"]))
 
-        imagine_prompt = ImaginePrompt(
-            prompt=", ".join([prompt["prompt"], "high quality, no text"]),
-            negative_prompt="deformed hands, too many fingers, weird fingers, wrong fingers, weird hands, malformed, strange, ugly, duplication, duplicates, mutilation, deformed, mutilated, mutation, twisted body, disfigured, bad anatomy, out of frame, extra fingers, mutated hands, poorly drawn hands, extra limbs, malformed limbs, missing arms, extra arms, missing legs, extra legs, mutated hands, extra hands, fused fingers, missing fingers, extra fingers, long neck, small head, closed eyes, rolling eyes, weird eyes, smudged face, blurred face, poorly drawn face, mutation, mutilation, cloned face, strange mouth, grainy, blurred, blurry, writing, calligraphy, signature, text, watermark, bad art",
-            control_inputs=[control_mode_depth],
+        settings = dict(
+            prompt=self.full_prompt(prompt["prompt"]),
+            negative_prompt=self.negative_prompt,
             seed=1,
             caption_text=prompt["caption"].upper(),
             init_image_strength=0.2,
-            mask_prompt="(female face OR male face OR person face OR face OR hair){-2}",
-            mask_mode=MaskMode.KEEP,
-            init_image=image,
+            mask_prompt=self.mask_prompt,
+            mask_mode=schema.MaskMode.KEEP,
             fix_faces=False,
         )
+        controls = [("depth", 0.5)]
 
-        def debug_callback(img, description, image_count, step_count, prompt):
-            if callback:
-                callback()
+        # Precomputed maps are used as they are, otherwise imaginAIry makes them
+        imagine_settings = dict(settings)
+        if preprocessed.face_mask is not None:
+            del imagine_settings["mask_prompt"]
+            imagine_settings["mask_image"] = preprocessed.face_mask
+        control_inputs = []
+        for mode, strength in controls:
+            if mode == "depth" and preprocessed.depth_map is not None:
+                control_inputs.append(
+                    schema.ControlInput(
+                        mode=mode, image_raw=preprocessed.depth_map, strength=strength
+                    )
+                )
+            else:
+                control_inputs.append(
+                    schema.ControlInput(mode=mode, image=image, strength=strength)
+                )
 
-        result = next(
-            imagine(prompts=imagine_prompt, debug_img_callback=debug_callback)
+        imagine_prompt = schema.ImaginePrompt(
+            **imagine_settings,
+            control_inputs=control_inputs,
+            init_image=image,
+        )
+
+        cache_key = ResultCache.key(
+            image,
+            {
+                **settings,
+                "control_inputs": controls,
+                "model": getattr(imagine_prompt, "model_weights", None),
+            },
         )
 
+        return imagine_prompt, cache_key, prompt
+
+    def tag(self, image, prompt):
+        # The chosen prompt travels with the result, for the session index
+        image.info["prompt"] = prompt["prompt"]
+        image.info["caption"] = prompt["caption"]
+        return image
+
+    def denoise_steps(self, imagine_prompt):
+        # img2img starts part way into the schedule, init_image_strength of
+        # the steps are skipped
+        steps = imagine_prompt.steps
+        if imagine_prompt.init_image is not None and imagine_prompt.init_image_strength:
+            steps -= int(steps * imagine_prompt.init_image_strength)
+        return steps
+
+    def generate_batch(self, jobs, use_cache=True):
+        # jobs is a list of (image, forced_prompt, callback, token), where image
+        # is a PIL image or a path. All prompts go through a single imagine()
+        # call so the loaded pipeline is reused across the batch, and the
+        # resulting PIL images come back in the same order. Cancelled jobs get
+        # None. Jobs found in the cache skip imagine() altogether.
+        self.backend.install_conditioning(self.conditioning)
+        use_cache = use_cache and self.cache is not None
+        prepared = [
+            self.prepare(image, forced_prompt) for image, forced_prompt, _, _ in jobs
+        ]
+        output_images = [None] * len(jobs)
+        pending = []
+        for index, (_, cache_key, prompt) in enumerate(prepared):
+            cached = self.cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                output_images[index] = self.tag(cached, prompt)
+            else:
+                pending.append(index)
+
+        current = {"index": 0}
+        totals = [self.denoise_steps(imagine_prompt) for imagine_prompt, _, _ in prepared]
+        steps_done = [0] * len(jobs)
+
+        def debug_callback(img, description, image_count, step_count, prompt):
+            index = current["index"]
+            _, _, callback, token = jobs[index]
+            if token:
+                token.check()  # Raises GenerationCancelled and stops the denoising
+            # Debug images also come for the init image, mask and control
+            # images, only a new step number is progress
+            if not callback or not isinstance(step_count, int) or step_count <= steps_done[index]:
+                return
+            steps_done[index] = step_count
+            totals[index] = max(totals[index], step_count)
+            callback(GenerationProgress(step_count, totals[index], GenerationProgress.DENOISE))
+            if step_count == totals[index]:
+                callback(
+                    GenerationProgress(step_count, totals[index], GenerationProgress.FINISH)
+                )
+
         # imagine_image_files(prompts=imagine_prompt, outdir="final", print_caption=True)
 
-        result.img.save(filename.split(".")[0] + "_generated." + filename.split(".")[1])
+        start = 0
+        while start < len(pending):
+            results = self.backend.imagine(
+                [prepared[index][0] for index in pending[start:]], debug_callback
+            )
+            for position in range(start, len(pending)):
+                index = pending[position]
+                current["index"] = index
+                start = position + 1
+                _, _, _, token = jobs[index]
+                saved_before = self.conditioning.saved_seconds
+                try:
+                    result = next(results)
+                    if token:
+                        token.check()
+                except GenerationCancelled:
+                    # imagine() can't resume after an exception, so it is
+                    # restarted with the rest of the batch
+                    break
+                saved = self.conditioning.saved_seconds - saved_before
+                print(f"Text conditioning cache saved {saved * 1000:.0f} ms")
+                output_images[index] = self.tag(result.img, prepared[index][2])
+                if use_cache:
+                    self.cache.put(prepared[index][1], result.img)
+        return output_images
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python generate.py <filename> <prompt>")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def output_path(path, output_dir=None, base="."):
+    # With output_dir, the input's path relative to base is kept below it
+    root, ext = os.path.splitext(path)
+    name = f"{root}_generated{ext}"
+    if output_dir is None:
+        return name
+    return os.path.join(output_dir, os.path.relpath(name, base))
+
+
+def glob_base(pattern):
+    # The folder a glob pattern starts from, e.g. sessions for sessions/**/1.jpg
+    parts = []
+    for part in pattern.replace(os.sep, "/").split("/")[:-1]:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return "/".join(parts) or "."
+
+
+def is_photo(path):
+    root, ext = os.path.splitext(path)
+    # Results and print strips in a sessions/ archive aren't photos
+    return (
+        ext.lower() in IMAGE_EXTENSIONS
+        and not root.endswith("_generated")
+        and os.path.basename(root) != "composition"
+    )
+
+
+def find_inputs(inputs, output_dir=None):
+    # Files, directories (searched recursively) and glob patterns, in order.
+    # Returns (input, output) pairs, earlier outputs are never used as inputs.
+    # Directories and globs keep their layout below output_dir, single files
+    # keep theirs relative to the folder all of them share.
+    files = [item for item in inputs if not os.path.isdir(item) and not glob.has_magic(item)]
+    files_base = (
+        os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+        if files
+        else "."
+    )
+
+    pairs = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = sorted(
+                os.path.join(directory, name)
+                for directory, _, names in os.walk(item)
+                for name in names
+            )
+            base = item
+        elif glob.has_magic(item):
+            paths = sorted(glob.glob(item, recursive=True))
+            base = glob_base(item)
+        else:
+            paths = [item]
+            base = files_base
+        for path in paths:
+            if not is_photo(path):
+                if path == item:
+                    print(f"Warning: Skipping {path}, not an image")
+                continue
+            pairs.append((path, output_path(path, output_dir, base)))
+
+    # Two inputs writing one output would overwrite each other, and a resumed
+    # run would skip the second as done
+    outputs = {}
+    unique = []
+    for path, output in pairs:
+        if output in outputs:
+            if os.path.abspath(outputs[output]) != os.path.abspath(path):
+                raise ValueError(f"{outputs[output]} and {path} would both be written to {output}")
+            continue  # The same input listed twice
+        outputs[output] = path
+        unique.append((path, output))
+    return unique
+
+
+def prefetched(pairs, load, threads):
+    # Loads the next inputs on worker threads while the current one generates
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        remaining = iter(pairs)
+        for pair in itertools.islice(remaining, threads * 2):
+            pending.append((pair, pool.submit(load, pair[0])))
+        while pending:
+            pair, future = pending.popleft()
+            following = next(remaining, None)
+            if following is not None:
+                pending.append((following, pool.submit(load, following[0])))
+            yield pair, future
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate images for files, folders or glob patterns, e.g. a whole event archive"
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="Images, folders or glob patterns. Read one per line from stdin if none are given or -",
+    )
+    parser.add_argument("--prompt", help="Use this prompt instead of a random one from the catalog")
+    parser.add_argument(
+        "--output-dir", help="Write results here instead of next to the inputs as *_generated"
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Generate again even if the output exists. Without it an interrupted run resumes.",
+    )
+    parser.add_argument("--prefetch", type=int, default=2, help="Threads decoding the next inputs")
+    parser.add_argument("--batch", type=int, default=1, help="Images per imagine() call")
+    args = parser.parse_args()
+
+    inputs = args.inputs
+    if (
+        len(inputs) == 2
+        and args.prompt is None
+        and not os.path.exists(inputs[1])
+        and not glob.has_magic(inputs[1])
+    ):
+        # The old form: python generate.py <filename> <prompt>
+        inputs, args.prompt = inputs[:1], inputs[1]
+    if not inputs or inputs == ["-"]:
+        if sys.stdin.isatty():
+            parser.print_usage()
+            sys.exit(1)
+        inputs = [line.strip() for line in sys.stdin if line.strip()]
+
+    try:
+        pairs = find_inputs(inputs, args.output_dir)
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
-    generator = ImageGenerator(warmup=False)
+    todo = [(path, output) for path, output in pairs if args.overwrite or not os.path.exists(output)]
+    skipped = len(pairs) - len(todo)
+    print(f"{len(todo)} images to generate, {skipped} already done")
+    if not todo:
+        return
+
+    # Loaded once for the whole run
+    generator = ImageGenerator(warmup=False, cache=ResultCache())
+
+    def load(path):
+        # Only decodes, preprocessing runs models and stays on the main thread
+        from PIL import Image
+
+        image = Image.open(path)
+        image.load()
+        return image.convert("RGB")
 
-    generator.generate(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None, None)
+    generated = 0
+    failed = 0
+    start = None
+
+    def save(output, result):
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_atomic(output, result.save)
+
+    def run(batch):
+        nonlocal generated, failed, start
+        if start is None:
+            start = time.perf_counter()  # Model loading doesn't count against the rate
+        try:
+            results = generator.generate_batch(
+                [(image, args.prompt, None, None) for _, image in batch]
+            )
+        except Exception as e:
+            print(f"Error: Generation failed for {', '.join(path for (path, _), _ in batch)}: {e}")
+            failed += len(batch)
+            return
+        for ((path, output), _), result in zip(batch, results):
+            try:
+                save(output, result)
+            except Exception as e:
+                print(f"Error: Could not save {output}: {e}")
+                failed += 1
+                continue
+            generated += 1
+        elapsed = time.perf_counter() - start
+        print(
+            f"[{generated + failed}/{len(todo)}] {output} "
+            f"({generated / elapsed * 60:.1f} images per minute)"
+        )
+
+    batch = []
+    for pair, future in prefetched(todo, load, max(1, args.prefetch)):
+        try:
+            batch.append((pair, generator.preprocess(future.result())))
+        except Exception as e:
+            print(f"Error: Could not load {pair[0]}: {e}")
+            failed += 1
+            continue
+        if len(batch) >= args.batch:
+            run(batch)
+            batch = []
+    if batch:
+        run(batch)
+
+    elapsed = time.perf_counter() - start if start is not None else 0
+    rate = generated / elapsed * 60 if elapsed else 0
+    print(
+        f"Generated {generated}, skipped {skipped}, failed {failed} "
+        f"in {elapsed:.0f}s, {rate:.1f} images per minute"
+    )
+    print(f"Cache: {generator.cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from fileutils import write_atomic
+
+
+# Keeps the images of the most recent sessions in memory, so capture,
+# generation and printing hand PIL images to each other directly. Every image
+# is also archived to sessions/<session>/<name>.jpg on a background thread,
+# and recorded in the SessionIndex if one is given.
+class ImageStore:
+    def __init__(self, root="sessions", max_sessions=2, index=None):
+        self.root = root
+        self.max_sessions = max_sessions
+        self.index = index
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending_writes = queue.Queue()
+        self.thread = threading.Thread(target=self._archive_loop, daemon=True)
+        self.thread.start()
+
+    def path(self, session, name):
+        return os.path.join(self.root, str(session), f"{name}.jpg")
+
+    def put(self, session, name, image):
+        with self.lock:
+            images = self.sessions.setdefault(session, {})
+            images[name] = image
+            self.sessions.move_to_end(session)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.pending_writes.put((session, name, image))
+
+    def get(self, session, name):
+        with self.lock:
+            image = self.sessions.get(session, {}).get(name)
+        if image is not None:
+            return image
+
+        # Older sessions only live on disk, e.g. for reprints
+        path = self.index and self.index.file(session, name)
+        if not path:
+            path = self.path(session, name)
+        if not os.path.exists(path):
+            return None
+        image = Image.open(path)
+        image.load()
+        return image
+
+    def _archive_loop(self):
+        while True:
+            item = self.pending_writes.get()
+            if item is None:
+                self.pending_writes.task_done()
+                break
+            session, name, image = item
+            path = self.path(session, name)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_atomic(path, image.save)
+                if self.index:
+                    self.index.add_file(session, name, path)
+            except Exception as e:
+                print(f"Error: Could not archive {path}: {e}")
+            finally:
+                self.pending_writes.task_done()
+
+    def flush(self):
+        self.pending_writes.join()
+
+    def stop(self):
+        self.pending_writes.put(None)
+        self.thread.join(timeout=5)
@@ -0,0 +1,144 @@
+import argparse
+import json
+import random
+import threading
+import time
+
+from PIL import Image
+
+from client import GenerationClient
+from metrics import percentile
+from server import GenerationServer
+from stub_generator import StubImageGenerator
+
+
+# Loopback load test for a generation server shared by several booths. Every
+# simulated booth runs sessions like a real one: it submits a take as soon as
+# the photo is taken, marks it as waiting once the confirmation countdown is
+# over, waits for the result, lets the user look at it and takes the next one.
+def run_booth(client, name, deadline, confirm_time, look_time, results):
+    rng = random.Random(name)
+    time.sleep(rng.uniform(0, confirm_time))  # Booths don't start in lockstep
+    take = 0
+    while time.time() < deadline:
+        take += 1
+        color = tuple(rng.randrange(256) for _ in range(3))
+        job = client.submit(Image.new("RGB", (512, 512), color), name=f"{name}/{take}")
+        time.sleep(confirm_time)
+        job.set_waiting()
+        waiting_time = time.time()
+        depth = client.queue_depth
+        job.wait()
+        if job.error:
+            results.append({"booth": name, "error": str(job.error)})
+            continue
+        results.append(
+            {
+                "booth": name,
+                "submitted": job.submitted_time,
+                "finished": job.finished_time,
+                # What the user sees: the time spent watching the progress bar
+                "wait": max(0, job.finished_time - waiting_time),
+                "latency": job.finished_time - job.submitted_time,
+                "queue_depth": depth,
+            }
+        )
+        time.sleep(look_time)
+
+
+def summarize(results, booths, elapsed):
+    done = [result for result in results if "error" not in result]
+    summary = {
+        "booths": booths,
+        "seconds": elapsed,
+        "jobs": len(done),
+        "errors": len(results) - len(done),
+        "jobs_per_minute": len(done) / elapsed * 60,
+        "per_booth": {},
+    }
+    for name, key in [("wait", "wait"), ("latency", "latency")]:
+        values = sorted(result[key] for result in done)
+        if values:
+            summary[name] = {
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+    depths = [result["queue_depth"] for result in done if result["queue_depth"] is not None]
+    summary["max_queue_depth"] = max(depths) if depths else None
+    for booth in sorted({result["booth"] for result in results}):
+        waits = sorted(result["wait"] for result in done if result["booth"] == booth)
+        summary["per_booth"][booth] = {
+            "jobs": len(waits),
+            "wait_p95": percentile(waits, 95) if waits else None,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a shared generation server")
+    parser.add_argument("--booths", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to keep submitting")
+    parser.add_argument("--confirm-time", type=float, default=5, help="Confirmation countdown")
+    parser.add_argument("--look-time", type=float, default=3, help="Time spent on each result")
+    parser.add_argument("--steps", type=int, default=30, help="Stub generator steps")
+    parser.add_argument("--step-time", type=float, default=0.05, help="Stub seconds per step")
+    parser.add_argument("--max-batch", type=int, default=1)
+    parser.add_argument("--output", help="Write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    # Port 0 picks any free port, so the test never clashes with a real server
+    server = GenerationServer(
+        StubImageGenerator(args.steps, args.step_time), "127.0.0.1", 0, args.max_batch
+    )
+    host, port = server.server_address
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    start = time.time()
+    deadline = start + args.duration
+    threads = [
+        threading.Thread(
+            target=run_booth,
+            args=(
+                GenerationClient(host, port, booth=f"booth-{i + 1}"),
+                f"booth-{i + 1}",
+                deadline,
+                args.confirm_time,
+                args.look_time,
+                results,
+            ),
+        )
+        for i in range(args.booths)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    server.server_close()
+
+    summary = summarize(results, args.booths, elapsed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    print(
+        f"{summary['jobs']} jobs from {args.booths} booths in {elapsed:.0f}s, "
+        f"{summary['jobs_per_minute']:.1f} per minute, {summary['errors']} errors"
+    )
+    if "wait" in summary:
+        wait = summary["wait"]
+        print(
+            f"User wait p50 {wait['p50']:.2f}s, p95 {wait['p95']:.2f}s, "
+            f"p99 {wait['p99']:.2f}s, max {wait['max']:.2f}s"
+        )
+    print(f"Max queue depth seen: {summary['max_queue_depth']}")
+    for booth, stats in summary["per_booth"].items():
+        wait_p95 = "-" if stats["wait_p95"] is None else f"{stats['wait_p95']:.2f}s"
+        print(f"  {booth}: {stats['jobs']} jobs, wait p95 {wait_p95}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,124 @@
+import sys
+
+from startup_profile import profile
+
+if "--profile-startup" in sys.argv:
+    # Must be enabled before the rest of the imports below
+    profile.enable_import_timing()
+
+import argparse
 import pygame
 import cv2
+import numpy as np
 import time
 import math
 import os
 
-from generate import ImageGenerator
-import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
 
+from generate import ImageGenerator
+from imagestore import ImageStore
+from metrics import metrics
+
+from camera import CameraCapture
+from client import GenerationClient
+from compositor import LayerCompositor
+from eta import EtaEstimator
+from framerate import FrameGovernor
 from printer import ImagePrinter
+from print_backends import create_backend
+from spooler import PrintJob, PrintSpooler
+from sessionindex import SessionIndex
+from worker import GenerationJob, GenerationProgress, GenerationWorker
+
+GENERATION_DONE = pygame.event.custom_type()
 
 
 class PhotoBooth:
-    def __init__(self):
-        pygame.init()
+    def __init__(
+        self,
+        generation_server=None,
+        print_backend="win32",
+        printer_name="Canon SELPHY CP1300",
+        fps=30,
+        busy_fps=10,
+        idle_fps=15,
+        idle_after=60,
+        frame_stats=False,
+        profile_startup=False,
+        startup_target=3.0,
+        camera=None,
+        generation_worker=None,
+        sessions_dir="sessions",
+        print_queue_dir="print_queue",
+        booth_name=None,
+    ):
+        # camera and generation_worker replace the webcam and the model, e.g.
+        # with synthetic ones in benchmark.py
+        self.profile_startup = profile_startup
+        self.startup_target = startup_target
+        self.startup_time = time.time()
+        self.first_frame_time = None
+        self.model_ready_reported = False
+        with profile.span("pygame.init"):
+            pygame.init()
         self.screen_info = pygame.display.Info()
         self.screen_width = 1280  # self.screen_info.current_w
         self.screen_height = 720  # self.screen_info.current_h
         self.sidebar_width = (self.screen_width - self.screen_height) / 2
         self.fullscreen = False
-        self.screen = pygame.display.set_mode((1280, 720))
-        self.screen.fill((255, 255, 255))
-        pygame.display.set_caption("AI Tinkerers Photobooth")
-        self.cap = cv2.VideoCapture(
-            0, cv2.CAP_DSHOW
-        )  # makes it load faster in Windows. Most likely no needed in Mac / Linux?
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)  # Set webcam to 720p
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-        self.cap.set(cv2.CAP_PROP_FPS, 30)
-        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
-        self.webcam_width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.webcam_height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        with profile.span("display"):
+            self.screen = pygame.display.set_mode((1280, 720))
+            self.screen.fill((255, 255, 255))
+            pygame.display.set_caption("AI Tinkerers Photobooth")
+        self.compositor = LayerCompositor(self.screen)
+        self.governor = FrameGovernor(fps, busy_fps, idle_fps)
+        self.idle_after = idle_after
+        self.frame_stats = frame_stats
+        self.frame_stats_time = time.time()
+        self.last_input_time = time.time()
+        # Captures and generations are handed between stages in memory and
+        # archived to sessions/ in the background
+        # Sessions, takes, prompts, files and timings, for reprints and galleries
+        self.index = SessionIndex(os.path.join(sessions_dir, "index.db"))
+        self.booth_name = booth_name
+        metrics.root = sessions_dir
+        metrics.index = self.index
+        self.images = ImageStore(sessions_dir, index=self.index)
+        # Learns generation times for the time left shown under the progress bar
+        self.eta = EtaEstimator(os.path.join(sessions_dir, "eta.json"))
+
+        # Opening the webcam and loading sounds and logos are mostly waiting on
+        # drivers and disk, so they all happen at the same time
+        with profile.span("camera, printer, sounds and logos"), ThreadPoolExecutor() as pool:
+            opening_camera = None
+            if camera is None:
+                opening_camera = pool.submit(
+                    lambda: CameraCapture(
+                        0, width=1280, height=720, fps=30  # Set webcam to 720p
+                    ).start()
+                )
+            printer = pool.submit(
+                ImagePrinter,
+                printer_name=printer_name,
+                image_store=self.images,
+                backend=create_backend(print_backend, printer_name),
+            )
+            sounds = {
+                name: pool.submit(pygame.mixer.Sound, f"sounds/{name}.mp3")
+                for name in ["shutter", "success", "print", "blip"]
+            }
+            logo = pool.submit(pygame.image.load, "sidebarlogo.png")
+        self.camera = camera if camera is not None else opening_camera.result()
+        self.printer = printer.result()
+        # Printing runs in the background, unprinted jobs survive a restart
+        self.spooler = PrintSpooler(self.printer, print_queue_dir, index=self.index)
+        self.sounds = {name: sound.result() for name, sound in sounds.items()}
+        self.logo = logo.result()
+        self.webcam_width = self.camera.width
+        self.webcam_height = self.camera.height
         self.running = True
         self.countdown_enabled = False
         self.countdown_message = "Get ready!"
@@ -41,21 +130,15 @@ class PhotoBooth:
         self.generated_image = None
         self.generated_image_time = 0
         self.camera_frame = None
-        self.session = int(time.time())
+        self.camera_frame_id = 0
+        self.camera_plan = None
+        self.session = None  # Created when the first take starts
         self.current_take = 0
-        self.generation_progress = 30
+        self.generation_job = None
+        self.generation_result = None
         self.printer_message_enabled = False
         self.printer_message_start_time = None        
-        self.printer = ImagePrinter(
-            printer_name="Canon SELPHY CP1300"  # "Microsoft Print to PDF"
-        )
-        self.sounds = {
-            "shutter": pygame.mixer.Sound("sounds/shutter.mp3"),
-            "success": pygame.mixer.Sound("sounds/success.mp3"),
-            "print": pygame.mixer.Sound("sounds/print.mp3"),
-            "blip": pygame.mixer.Sound("sounds/blip.mp3"),
-        }
-        self.logo = pygame.image.load("sidebarlogo.png")
+        self.print_job = None
         self.confirmation_countdown_enabled = False
         self.confirmation_start_time = None
         
@@ -63,23 +146,38 @@ class PhotoBooth:
         self.main_font_color = (72, 89, 173)
         self.side_font_color = (200, 50, 50)
 
-        # Create a surface for the "Warming up" message
-        self.warmup_surface = pygame.Surface((self.screen_width, self.screen_height))
-        self.warmup_surface.fill((255, 255, 255))  # White background
-
-        self.render_text_with_outline("Warming up", pygame.font.Font(None, 100), self.main_font_color, (self.screen_width // 2, self.screen_height // 2))       
-        
-
-        pygame.display.flip()
-        
-
-        self.image_generator = ImageGenerator(warmup=True)
+        # Fonts and rendered text are cached, keyed by (text, size, color, outline)
+        self.fonts = {}
+        self.text_cache = {}
+
+        if generation_worker is not None:
+            self.generation_worker = generation_worker
+        elif generation_server:
+            # Generations run in server.py, so a model crash can't take the UI down
+            host, port = generation_server.rsplit(":", 1)
+            with profile.span("generation client"):
+                self.generation_worker = GenerationClient(host, int(port), booth=booth_name)
+        else:
+            # The model loads and warms up in the background while the booth is
+            # already usable, photos taken in the meantime are queued. No
+            # ResultCache, a fresh photo with a random prompt never hits it.
+            with profile.span("generation worker"):
+                self.generation_worker = GenerationWorker(
+                    create_generator=lambda callback: ImageGenerator(
+                        warmup=True, callback=callback
+                    )
+                )
 
     def handle_events(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.running = False
+            elif event.type == GENERATION_DONE:
+                # Results of cancelled or superseded jobs are ignored
+                if event.job is self.generation_job:
+                    self.generation_result = event.image
             elif event.type == pygame.KEYDOWN:
+                self.last_input_time = time.time()
                 if event.key == pygame.K_ESCAPE:
                     self.running = False
                 elif event.mod & pygame.KMOD_LALT and event.key == pygame.K_RETURN:
@@ -91,6 +189,8 @@ class PhotoBooth:
                 ):
                     if self.confirmation_countdown_enabled:
                         self.confirmation_countdown_enabled = False
+                        # Throw away the generation started for the rejected photo
+                        self.generation_job.cancel()
                         self.current_take -= 1
                     self.start_next_take()
 
@@ -110,13 +210,20 @@ class PhotoBooth:
             self.fullscreen = False
 
         self.sidebar_width = (self.screen_width - self.screen_height) / 2
+        self.camera_frame_id = 0  # Force the next frame to be rescaled
+        self.camera_plan = None
+        self.compositor.reset(self.screen)
 
     def take_photo(self):
+        shutter_time = time.time()
+        start = time.perf_counter()
         self.flash_screen_enabled = True
         self.sounds["shutter"].play()
-        self.flash_start_time = time.time()
-        os.makedirs(f"sessions/{self.session}", exist_ok=True)
-        ret, frame = self.cap.read()
+        self.flash_start_time = shutter_time
+        _, _, frame = self.camera.closest(shutter_time)
+        if frame is None:
+            print("Warning: No camera frame available")
+            return
         frame = cv2.flip(frame, 1)
         height, width, _ = frame.shape
         new_size = min(width, height)
@@ -126,42 +233,74 @@ class PhotoBooth:
         bottom = (height + new_size) // 2
         frame = frame[top:bottom, left:right]
         frame = cv2.resize(frame, (512, 512))
-        cv2.imwrite(f"sessions/{self.session}/{self.current_take}.jpg", frame)
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        self.images.put(self.session, str(self.current_take), image)
+        metrics.record(
+            "capture", time.perf_counter() - start, self.session, self.current_take, shutter_time
+        )
         self.hold_frame_enabled = True
-        self.generation_progress = 0
         self.confirmation_countdown_enabled = True
         self.confirmation_start_time = time.time()
+        # Start generating right away, a retake during the confirmation
+        # countdown cancels it
+        self.generate_image(image)
 
     def show_generated_image(self):
-        for _ in range(5):
-            try:
-                self.generated_image = pygame.image.load(
-                    f"sessions/{self.session}/{self.current_take}_generated.jpg"
-                )
-                break
-            except:
-                time.sleep(0.5)
-
         self.generated_image_enabled = True
         self.sounds["success"].play()
-        self.generated_image = pygame.transform.smoothscale(
-            self.generated_image, (self.screen_height, self.screen_height)
-        )
+        with metrics.span("result_load", self.session, self.current_take):
+            self.generated_image = pygame.transform.smoothscale(
+                self.generation_result, (self.screen_height, self.screen_height)
+            )
         self.generated_image_time = time.time()
 
-    def generate_image(self):
-        self.generation_progress = 0
-        threading.Thread(
-            target=self.image_generator.generate,
-            args=(
-                f"sessions/{self.session}/{self.current_take}.jpg",
-                None,
-                self.update_progress,
-            ),
-        ).start()
+    def generate_image(self, image):
+        session, take = self.session, self.current_take
+        self.generation_result = None
+        self.generation_job = self.generation_worker.submit(
+            image, name=f"{session}/{take}"
+        )
+        self.generation_job.add_done_callback(
+            lambda job: self.on_generation_done(job, session, take)
+        )
 
-    def update_progress(self):
-        self.generation_progress += 1
+    def on_generation_done(self, job, session, take):
+        # Runs on the generation thread, so the conversion stays off the UI thread
+        if job.cancelled():
+            return
+        self.record_generation_metrics(job, session, take)
+        self.eta.observe(job)
+        info = job.result.info if job.status == GenerationJob.DONE else {}
+        self.index.set_take(session, take, info.get("prompt"), info.get("caption"), job.status)
+        start = time.perf_counter()
+        if job.status == GenerationJob.DONE:
+            image = job.result.convert("RGB")
+            self.images.put(session, f"{take}_generated", image)
+            self.printer.add_take(session, take, job.image, image)
+        else:
+            # Show the original photo rather than leaving the booth stuck
+            image = job.image
+            self.printer.add_take(session, take, job.image, None)
+        surface = pygame.image.frombytes(image.tobytes(), image.size, "RGB")
+        metrics.record("result_convert", time.perf_counter() - start, session, take)
+        pygame.event.post(pygame.event.Event(GENERATION_DONE, job=job, image=surface))
+
+    def record_generation_metrics(self, job, session, take):
+        if job.started_time is None:
+            return  # Failed before it ever ran, e.g. a full queue
+        metrics.record(
+            "queue", job.started_time - job.submitted_time, session, take, job.submitted_time
+        )
+        if job.preprocess_seconds is not None:
+            metrics.record("preprocess", job.preprocess_seconds, session, take)
+        metrics.record(
+            "generate",
+            job.finished_time - job.started_time,
+            session,
+            take,
+            job.started_time,
+            status=job.status,
+        )
 
     def start_next_take(self):
         self.current_take += 1
@@ -175,48 +314,93 @@ class PhotoBooth:
         self.countdown_start_time = time.time()
 
         if self.current_take == 1:
-            self.session = int(time.time())
+            # Unique even if two sessions start in the same second
+            self.session = self.index.new_session(self.booth_name)
             self.countdown_message = "Get ready!"
 
     def print_photos(self):
         self.printer_message_enabled = True
         self.sounds["print"].play()
         self.printer_message_start_time = time.time()
-        self.printer.print_session(self.session)
+        self.print_job = self.spooler.submit(self.session)
 
     def render_camera_frame(self):
         if not self.hold_frame_enabled:
-            ret, frame = self.cap.read()
-            if not ret:
+            frame_id, _, frame = self.camera.latest()
+            if frame is None:
                 return False
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = pygame.surfarray.make_surface(frame)
-            frame = pygame.transform.rotate(frame, -90)
-            self.camera_frame = pygame.transform.smoothscale(
-                frame, (self.screen_width, self.screen_height)
-            )
-        self.screen.fill(
-            (255, 255, 255)
-        )  # Fill the screen with white color before blitting the frame
-        self.screen.blit(
-            self.camera_frame,
-            (0, 0),
+            # Reuse the last converted frame until the capture thread has a new one
+            if frame_id != self.camera_frame_id:
+                self.camera_frame_id = frame_id
+                plan = self.camera_plan
+                if plan is None or plan["shape"] != frame.shape:
+                    plan = self.plan_camera_frame(frame)
+                left, right = plan["crop"]
+                # Mirror the preview while copying only the visible columns
+                cv2.flip(frame[:, left:right], 1, dst=plan["buffer"])
+                if plan["scaled"] is None:
+                    self.camera_frame = plan["source"]
+                else:
+                    self.camera_frame = pygame.transform.smoothscale(
+                        plan["source"],
+                        plan["scaled"].get_size(),
+                        dest_surface=plan["scaled"],
+                    )
+        center_rect = self.center_rect()
+        self.screen.blit(self.camera_frame, center_rect)
+        self.compositor.mark_static(center_rect)
+
+    def plan_camera_frame(self, frame):
+        # Only the center square is visible between the sidebars, so the frame
+        # is cropped to the matching region before any per-pixel work is done
+        frame_height, frame_width, _ = frame.shape
+        crop_width = min(
+            frame_width, round(self.screen_height * frame_width / self.screen_width)
         )
+        left = (frame_width - crop_width) // 2
+        buffer = np.empty((frame_height, crop_width, 3), dtype=np.uint8)
+        # frombuffer shares memory with the array, so the surface sees every
+        # write to the buffer without copying or converting from BGR
+        source = pygame.image.frombuffer(buffer, (crop_width, frame_height), "BGR")
+        size = (self.screen_height, self.screen_height)
+        self.camera_plan = {
+            "shape": frame.shape,
+            "crop": (left, left + crop_width),
+            "buffer": buffer,
+            "source": source,
+            # At 720p in a 1280x720 window the crop is already the right size
+            "scaled": None if source.get_size() == size else pygame.Surface(size, 0, source),
+        }
+        return self.camera_plan
 
-    def render_take_number(self):
+    def center_rect(self):
+        return pygame.Rect(self.sidebar_width, 0, self.screen_height, self.screen_height)
+
+    def sidebar_rects(self):
+        return [
+            pygame.Rect(0, 0, self.sidebar_width, self.screen_height),
+            pygame.Rect(
+                self.sidebar_width + self.screen_height,
+                0,
+                self.sidebar_width,
+                self.screen_height,
+            ),
+        ]
+
+    def render_take_number(self, surface):
         if self.current_take > 0:
-            take_text = pygame.font.Font(None, 50).render(
-                f"Photo {self.current_take} / 3", True, self.main_font_color
+            take_text = self.get_text_surface(
+                f"Photo {self.current_take} / 3", 50, self.main_font_color
             )
 
-            self.screen.blit(
+            surface.blit(
                 take_text,
                 (
                     45,
                     30,
                 ),
             )
-            self.screen.blit(
+            surface.blit(
                 take_text,
                 (
                     self.screen_width - take_text.get_width() - 45,
@@ -226,39 +410,61 @@ class PhotoBooth:
 
            
 
-    def render_text_with_outline(self, text, font, color, position, alpha=255):
-        outline_color = (255, 255, 255)  # White outline
-        outline_width = 2
-
-        # Render the outline
-        outline_surface = font.render(text, True, outline_color)
-        outline_surface.set_alpha(alpha)
-        outline_rect = outline_surface.get_rect(center=position)
+    def get_font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = pygame.font.Font(None, size)
+            font.align = pygame.FONT_CENTER
+            self.fonts[size] = font
+        return font
 
-        # Create a temporary surface for blitting outlines
-        temp_surface = pygame.Surface(self.screen.get_size(), pygame.SRCALPHA)
+    def get_text_surface(self, text, size, color, outline_width=0):
+        key = (text, size, color, outline_width)
+        surface = self.text_cache.get(key)
+        if surface is not None:
+            return surface
 
-        # Blit outline in all directions on the temporary surface
-        for dx, dy in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
-            temp_surface.blit(outline_surface, (outline_rect.x + dx * outline_width, outline_rect.y + dy * outline_width))
+        if len(self.text_cache) >= 256:
+            self.text_cache.clear()
 
-        # Render the main text
+        font = self.get_font(size)
         text_surface = font.render(text, True, color)
-        text_surface.set_alpha(alpha)
-        text_rect = text_surface.get_rect(center=position)
-        temp_surface.blit(text_surface, text_rect)
+        if not outline_width:
+            surface = text_surface
+        else:
+            outline_color = (255, 255, 255)  # White outline
+            outline_surface = font.render(text, True, outline_color)
 
-        # Blit the temporary surface onto the screen
-        self.screen.blit(temp_surface, (0, 0))
+            # Only as big as the text plus the outline on every side
+            surface = pygame.Surface(
+                (
+                    text_surface.get_width() + outline_width * 2,
+                    text_surface.get_height() + outline_width * 2,
+                ),
+                pygame.SRCALPHA,
+            )
 
-    
+            # Blit outline in all directions
+            for dx, dy in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
+                surface.blit(
+                    outline_surface,
+                    (outline_width + dx * outline_width, outline_width + dy * outline_width),
+                )
+            surface.blit(text_surface, (outline_width, outline_width))
+
+        self.text_cache[key] = surface
+        return surface
+
+    def render_text_with_outline(self, text, size, color, position, alpha=255):
+        surface = self.get_text_surface(text, size, color, outline_width=2)
+        # Cached surfaces are shared, so alpha is applied right before blitting
+        surface.set_alpha(alpha)
+        self.compositor.mark(self.screen.blit(surface, surface.get_rect(center=position)))
 
     def render_press_button(self):
         if (
             self.current_take == 0
         ) and not self.printer_message_enabled:
-            font = pygame.font.Font(None, 50)
-            font.align = pygame.FONT_CENTER
             alpha = int((math.sin(time.time() * 2) + 1) * 155 + 100)
             
             left_position = (self.sidebar_width // 2, self.screen_height - 50)
@@ -266,10 +472,10 @@ class PhotoBooth:
             
             for position in [left_position, right_position]:
 
-                text_surface = font.render("Press the big\nred button!", True, self.side_font_color)
+                text_surface = self.get_text_surface("Press the big\nred button!", 50, self.side_font_color)
                 text_surface.set_alpha(alpha)
                 text_rect = text_surface.get_rect(center=position)
-                self.screen.blit(text_surface, text_rect)
+                self.compositor.mark(self.screen.blit(text_surface, text_rect))
 
     def render_countdown(self):
         if self.countdown_enabled:
@@ -291,12 +497,12 @@ class PhotoBooth:
                 self.take_photo()
 
             alpha = int(255 - (elapsed_time % 1) * 255)
-            font = pygame.font.Font(None, 300 if len(str(self.countdown_message)) == 1 else 100)
+            font_size = 300 if len(str(self.countdown_message)) == 1 else 100
             position = (self.screen_width // 2, self.screen_height // 2)
             
             self.render_text_with_outline(
                 str(self.countdown_message),
-                font,
+                font_size,
                 self.main_font_color,
                 position,
                 alpha=alpha                
@@ -307,32 +513,29 @@ class PhotoBooth:
             elapsed_time = time.time() - self.confirmation_start_time
             remaining_time = max(0, 5 - int(elapsed_time))
 
-            font = pygame.font.Font(None, 100)
             position = (self.screen_width // 2, 100)
-            self.render_text_with_outline(f"Is it good?", font, self.main_font_color, position)
+            self.render_text_with_outline(f"Is it good?", 100, self.main_font_color, position)
             
-            font = pygame.font.Font(None, 50)
             position = (self.screen_width // 2, self.screen_height - 150)
-            self.render_text_with_outline(f"If not, press the button to retake", font, self.main_font_color, position)
+            self.render_text_with_outline(f"If not, press the button to retake", 50, self.main_font_color, position)
 
-            font = pygame.font.Font(None, 100)            
             position = (self.screen_width // 2, self.screen_height - 90)
-            self.render_text_with_outline(f"{remaining_time}", font, self.main_font_color, position)
+            self.render_text_with_outline(f"{remaining_time}", 100, self.main_font_color, position)
             
             if elapsed_time > 5:
                 self.confirmation_countdown_enabled = False
-                self.generate_image()
+                # The user now waits for the result, a shared server runs it sooner
+                self.generation_job.set_waiting()
 
     def render_press_to_continue(self):
         if self.generated_image_enabled:
-            font = pygame.font.Font(None, 50)
             position = (self.screen_width // 2, 50)            
             
             alpha = int(127.5 + 127.5 * math.sin(time.time() * 2))  
             
             self.render_text_with_outline(
                 f"Press the button to {'take the next photo' if self.current_take < 3 else 'print your photos'}",
-                font,
+                50,
                 self.main_font_color,
                 position,
                 alpha=alpha
@@ -342,8 +545,6 @@ class PhotoBooth:
     def render_printer_message(self):
         if self.printer_message_enabled:
             elapsed_time = time.time() - self.printer_message_start_time
-            font = pygame.font.Font(None, 70)
-            font.align = pygame.FONT_CENTER
             position = (self.screen_width // 2, self.screen_height // 2)
             
             if elapsed_time <= 1:
@@ -357,12 +558,36 @@ class PhotoBooth:
                 alpha = 0
                 self.current_take = 0  # Reset for the next photo
 
-            message = "Check the printer\nfor your photo!".upper()
-            self.render_text_with_outline(message, font, self.main_font_color, position, alpha=alpha)
+            if self.print_job is not None and self.print_job.status == PrintJob.FAILED:
+                message = "Printing failed,\nplease ask for help!".upper()
+            else:
+                message = "Check the printer\nfor your photo!".upper()
+            self.render_text_with_outline(message, 70, self.main_font_color, position, alpha=alpha)
+
+    def render_print_status(self):
+        # The printer message is gone long before retries give up, so the
+        # job's state stays on screen until it has printed. A failure stays
+        # until the next session starts.
+        job = self.print_job
+        if job is None or self.printer_message_enabled or job.status == PrintJob.DONE:
+            return
+        if job.status == PrintJob.FAILED:
+            if self.current_take != 0:
+                return
+            message = "Printing failed, please ask for help!"
+        elif job.status == PrintJob.PRINTING:
+            message = "Printing..." if job.attempts <= 1 else f"Printing, attempt {job.attempts}..."
+        elif job.attempts:
+            message = "Printer problem, retrying..."
+        else:
+            message = "Waiting for the printer..."
+        position = (self.screen_width / 2, self.screen_height - 45)
+        self.render_text_with_outline(message.upper(), 30, self.main_font_color, position)
 
     def render_flash_screen(self):
         if self.flash_screen_enabled:
-            self.screen.fill((255, 255, 255))
+            # The sidebars are already white, only the camera area needs flashing
+            self.screen.fill((255, 255, 255), self.center_rect())
             if time.time() - self.flash_start_time >= 0.5:
                 self.flash_screen_enabled = False
 
@@ -380,7 +605,7 @@ class PhotoBooth:
                 (((self.screen_width - self.screen_height) / 2), 0),
             )
 
-    def render_logo(self):
+    def render_logo(self, surface):
         logo = pygame.transform.smoothscale(
             self.logo,
             (
@@ -391,8 +616,8 @@ class PhotoBooth:
             ),
         )
 
-        self.screen.blit(logo, (0, self.screen_height / 2 - logo.get_height() / 2))
-        self.screen.blit(
+        surface.blit(logo, (0, self.screen_height / 2 - logo.get_height() / 2))
+        surface.blit(
             logo,
             (
                 self.sidebar_width + self.screen_height,
@@ -402,9 +627,7 @@ class PhotoBooth:
 
     def render_progress_bar(self):
         if self.hold_frame_enabled and not self.generated_image_enabled and not self.confirmation_countdown_enabled:
-            if os.path.exists(
-                f"sessions/{self.session}/{self.current_take}_generated.jpg"
-            ):
+            if self.generation_result is not None:
                 self.show_generated_image()
 
             # Draw progress bar border
@@ -426,25 +649,68 @@ class PhotoBooth:
                 (
                     self.screen_width / 2 - (self.screen_width / 2) / 2,
                     self.screen_height / 2 + 20,
-                    (self.generation_progress / 59) * (self.screen_width / 2),
+                    self.generation_job.progress.fraction() * (self.screen_width / 2),
                     40,
                 ),
             )
             # Draw "Generating..." text
-            font = pygame.font.Font(None, 100)
             position = (self.screen_width / 2, self.screen_height / 2 - 60)
             
             alpha = int((math.sin(time.time() * 2) + 1) * 127.5 + 127.5)  # Adjusted to range 127.5-255
-            self.render_text_with_outline("Generating...", font, self.main_font_color, position, alpha)
+            self.render_text_with_outline("Generating...", 100, self.main_font_color, position, alpha)
+
+            position = (self.screen_width / 2, self.screen_height / 2 + 100)
+            ahead = self.generation_job.queue_position
+            if ahead and self.generation_job.progress.phase == GenerationProgress.QUEUED:
+                # Other booths are sharing the generation server
+                message = f"{ahead} photo{'s' if ahead > 1 else ''} ahead of yours"
+                self.render_text_with_outline(message, 50, self.main_font_color, position)
+            else:
+                remaining = self.eta.remaining(self.generation_job)
+                if remaining is not None:
+                    message = f"About {math.ceil(remaining)}s left" if remaining >= 1 else "Almost there..."
+                    self.render_text_with_outline(message, 50, self.main_font_color, position)
+
+    def render_loading_indicator(self):
+        if self.generation_worker.is_ready():
+            load_error = self.generation_worker.load_error
+            if not self.model_ready_reported:
+                self.model_ready_reported = True
+                ready_time = self.generation_worker.ready_time or time.time()
+                if load_error is None:
+                    print(f"Startup: model ready after {ready_time - self.startup_time:.2f}s")
+                else:
+                    print(
+                        f"Startup: model failed to load after "
+                        f"{ready_time - self.startup_time:.2f}s: {load_error}"
+                    )
+            if load_error is not None:
+                # Photos are still taken, but every generation will fail
+                position = (self.screen_width / 2, 45)
+                self.render_text_with_outline(
+                    "THE AI COULD NOT BE LOADED,\nPLEASE ASK FOR HELP!", 30, self.main_font_color, position
+                )
+            return
+
+        bar_width = self.screen_height / 2
+        left = self.screen_width / 2 - bar_width / 2
+        top = self.screen_height - 25
+        progress = self.generation_worker.loading_progress.fraction()
+        pygame.draw.rect(self.screen, (255, 255, 255), (left, top, bar_width, 10), 1)
+        pygame.draw.rect(
+            self.screen, self.main_font_color, (left, top, progress * bar_width, 10)
+        )
+        position = (self.screen_width / 2, self.screen_height - 45)
+        self.render_text_with_outline("Warming up the AI...", 30, self.main_font_color, position)
 
-    def render_sidebars(self):
+    def render_sidebars(self, surface):
         pygame.draw.rect(
-            self.screen,
+            surface,
             (255, 255, 255),
             (0, 0, self.sidebar_width, self.screen_height),
         )
         pygame.draw.rect(
-            self.screen,
+            surface,
             (255, 255, 255),
             (
                 self.sidebar_width + self.screen_height,
@@ -454,28 +720,137 @@ class PhotoBooth:
             ),
         )
 
+    def build_static_layer(self, surface):
+        surface.fill((255, 255, 255))
+        self.render_sidebars(surface)
+        self.render_logo(surface)
+        self.render_take_number(surface)
+
+    def render_static_layer(self):
+        # Sidebars, logos and the take counter only change with the take number
+        # or the resolution, so they are baked once and restored where needed
+        self.compositor.draw_static(
+            self.current_take, self.build_static_layer, self.sidebar_rects()
+        )
+
+    def frame_mode(self):
+        if (
+            self.hold_frame_enabled
+            and not self.generated_image_enabled
+            and not self.confirmation_countdown_enabled
+        ):
+            # Only the progress bar moves while the generation runs
+            return FrameGovernor.BUSY
+        if (
+            self.current_take == 0
+            and not self.countdown_enabled
+            and not self.printer_message_enabled
+            and time.time() - self.last_input_time > self.idle_after
+        ):
+            return FrameGovernor.IDLE
+        return FrameGovernor.PREVIEW
+
+    def render_frame(self):
+        self.handle_events()
+        self.render_camera_frame()
+        self.render_static_layer()
+        self.render_countdown()
+        self.render_confirmation_countdown()            
+        self.render_progress_bar()
+        self.render_generated_image()
+        self.render_printer_message()
+        self.render_print_status()
+        self.render_press_button()
+        self.render_press_to_continue()
+        self.render_flash_screen()
+        self.render_loading_indicator()
+
+        self.compositor.flush()
+
     def run(self):
         while self.running:
-            self.handle_events()
-            self.render_camera_frame()
-            self.render_sidebars()            
-            self.render_countdown()
-            self.render_confirmation_countdown()            
-            self.render_progress_bar()
-            self.render_generated_image()
-            self.render_printer_message()
-            self.render_press_button()
-            self.render_press_to_continue()
-            self.render_flash_screen()
-            
-            self.render_take_number()
-            self.render_logo()
-
-            pygame.display.flip()
-        self.cap.release()
+            self.render_frame()
+            if self.first_frame_time is None:
+                self.first_frame_time = time.time()
+                print(f"Startup: first frame after {self.first_frame_time - self.startup_time:.2f}s")
+                if self.profile_startup:
+                    profile.disable_import_timing()
+                    profile.mark("first frame")
+                    print(profile.report(target=self.startup_target))
+
+            self.governor.tick(self.frame_mode())
+            if self.frame_stats and time.time() - self.frame_stats_time >= 10:
+                self.frame_stats_time = time.time()
+                print(self.governor.report())
+        print(self.governor.report())
+        self.generation_worker.stop()
+        self.spooler.stop()
+        self.images.stop()
+        metrics.stop()
+        self.camera.release()
         pygame.quit()
 
 
 if __name__ == "__main__":
-    webcam_feed = PhotoBooth()
+    parser = argparse.ArgumentParser(description="AI Tinkerers Photobooth")
+    parser.add_argument(
+        "--server",
+        metavar="HOST:PORT",
+        help="Use a generation server (see server.py) instead of loading the model here",
+    )
+    parser.add_argument(
+        "--booth",
+        help="Name of this booth on a shared generation server, its address by default",
+    )
+    parser.add_argument(
+        "--print-backend",
+        choices=["win32", "lp", "file"],
+        default="win32" if sys.platform == "win32" else "lp",
+        help="Print with the Windows spooler, CUPS (lp) or to PDF files in prints/",
+    )
+    parser.add_argument(
+        "--printer",
+        default="Canon SELPHY CP1300",  # "Microsoft Print to PDF"
+        help="Printer name",
+    )
+    parser.add_argument(
+        "--fps", type=int, default=30, help="Frame rate of the live camera preview"
+    )
+    parser.add_argument(
+        "--busy-fps", type=int, default=10, help="Frame rate while a generation is running"
+    )
+    parser.add_argument(
+        "--idle-fps", type=int, default=15, help="Frame rate when nobody is using the booth"
+    )
+    parser.add_argument(
+        "--frame-stats",
+        action="store_true",
+        help="Print the frame rate, frame time and jitter every 10 seconds",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print an import and init time breakdown once the first frame is shown",
+    )
+    parser.add_argument(
+        "--startup-target",
+        type=float,
+        default=3.0,
+        help="Cold start target for the first frame in seconds, used by --profile-startup",
+    )
+    args = parser.parse_args()
+
+    webcam_feed = PhotoBooth(
+        generation_server=args.server,
+        booth_name=args.booth,
+        print_backend=args.print_backend,
+        printer_name=args.printer,
+        fps=args.fps,
+        busy_fps=args.busy_fps,
+        idle_fps=args.idle_fps,
+        frame_stats=args.frame_stats,
+        profile_startup=args.profile_startup,
+        startup_target=args.startup_target,
+    )
+    profile.mark("booth initialized")
     webcam_feed.run()
@@ -0,0 +1,136 @@
+import argparse
+import datetime
+import glob
+import json
+import math
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Per-stage timings of every session, appended to sessions/metrics-<date>.jsonl
+# as one JSON object per line. Spans are written on a background thread, so
+# recording one costs the UI thread no more than a queue put. With an index
+# (a SessionIndex), session spans are also stored with the session.
+class Metrics:
+    def __init__(self, root="sessions", index=None):
+        self.root = root
+        self.index = index
+        self.pending = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def path(self, date):
+        return os.path.join(self.root, f"metrics-{date.isoformat()}.jsonl")
+
+    def record(self, stage, seconds, session=None, take=None, start=None, **fields):
+        start = time.time() - seconds if start is None else start
+        span = {"stage": stage, "session": session, "take": take, "start": start, "seconds": seconds}
+        span.update(fields)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_loop, daemon=True)
+                self.thread.start()
+        self.pending.put(span)
+
+    @contextmanager
+    def span(self, stage, session=None, take=None, **fields):
+        start = time.time()
+        counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - counter, session, take, start, **fields)
+
+    def _write_loop(self):
+        while True:
+            span = self.pending.get()
+            if span is None:
+                self.pending.task_done()
+                break
+            try:
+                path = self.path(datetime.date.fromtimestamp(span["start"]))
+                os.makedirs(self.root, exist_ok=True)
+                with open(path, "a") as f:
+                    f.write(json.dumps(span) + "\n")
+                if self.index and span["session"] is not None:
+                    self.index.add_timing(
+                        span["session"], span["take"], span["stage"], span["seconds"], span["start"]
+                    )
+            except Exception as e:
+                print(f"Error: Could not write metrics: {e}")
+            finally:
+                self.pending.task_done()
+
+    def flush(self):
+        self.pending.join()
+
+    def stop(self):
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join(timeout=5)
+
+    def load(self, since=None, until=None):
+        spans = []
+        for path in sorted(glob.glob(os.path.join(self.root, "metrics-*.jsonl"))):
+            date = datetime.date.fromisoformat(os.path.basename(path)[8:-6])
+            if (since and date < since) or (until and date > until):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        pass  # A line cut short by a crash
+        return spans
+
+
+def percentile(values, p):
+    # Nearest rank, values must be sorted
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(spans):
+    stages = {}
+    for span in spans:
+        stages.setdefault(span["stage"], []).append(span["seconds"])
+    summary = {}
+    for stage, times in stages.items():
+        times.sort()
+        summary[stage] = {
+            "count": len(times),
+            "p50": percentile(times, 50),
+            "p95": percentile(times, 95),
+            "p99": percentile(times, 99),
+        }
+    return summary
+
+
+metrics = Metrics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage timing summary of the booth")
+    parser.add_argument("--since", type=datetime.date.fromisoformat, help="First day, YYYY-MM-DD")
+    parser.add_argument("--until", type=datetime.date.fromisoformat, help="Last day, YYYY-MM-DD")
+    parser.add_argument("--root", default="sessions", help="Folder with the metrics files")
+    args = parser.parse_args()
+
+    spans = Metrics(args.root).load(args.since, args.until)
+    if not spans:
+        print("No timings recorded in that range")
+        return
+    sessions = {span["session"] for span in spans if span["session"] is not None}
+    print(f"{len(spans)} spans from {len(sessions)} sessions")
+    print(f"{'stage':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in sorted(summarize(spans).items()):
+        print(
+            f"{stage:<16}{stats['count']:>8}{stats['p50'] * 1000:>10.1f}"
+            f"{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
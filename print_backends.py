@@ -0,0 +1,112 @@
+import os
+import subprocess
+import tempfile
+import time
+
+
+# A backend gets the finished strip and sends it somewhere. Errors are raised,
+# the spooler takes care of retries.
+class PrintBackend:
+    def print_image(self, image, document_name, printer_name=None):
+        raise NotImplementedError
+
+
+class Win32PrintBackend(PrintBackend):
+    def __init__(self, printer_name=None):
+        self.printer_name = printer_name
+
+    def print_image(self, image, document_name, printer_name=None):
+        # The Windows printing modules are only needed once something is printed
+        import win32print
+        import win32ui
+        from PIL import ImageWin
+
+        img = image.rotate(90, expand=True)
+
+        # Get the printer name
+        if printer_name is None:
+            if self.printer_name is None:
+                print("Using default printer...")
+                printer_name = win32print.GetDefaultPrinter()
+            else:
+                printer_name = self.printer_name
+
+        hprinter = win32print.OpenPrinter(printer_name)
+
+        try:
+            print("Printing...")
+            hdc = win32ui.CreateDC()
+            hdc.CreatePrinterDC(printer_name)
+            hdc.StartDoc(document_name)
+            hdc.StartPage()
+
+            # Get the printer surface size
+            printer_surface_width = hdc.GetDeviceCaps(8)  # HORZRES
+            printer_surface_height = hdc.GetDeviceCaps(10)  # VERTRES
+
+            # Calculate the position to center the image
+            x = (printer_surface_width - img.width) // 2
+            y = (printer_surface_height - img.height) // 2
+
+            dib = ImageWin.Dib(img)
+            dib.draw(
+                hdc.GetHandleOutput(),
+                (x, y, x + img.width, y + img.height),
+            )
+
+            hdc.EndPage()
+            hdc.EndDoc()
+            hdc.DeleteDC()
+        finally:
+            win32print.ClosePrinter(hprinter)
+
+
+class LpPrintBackend(PrintBackend):
+    # CUPS, through the lp command
+    def __init__(self, printer_name=None, options=None):
+        self.printer_name = printer_name
+        self.options = options or []
+
+    def print_image(self, image, document_name, printer_name=None):
+        printer_name = printer_name or self.printer_name
+        fd, path = tempfile.mkstemp(suffix=".jpg", prefix="photobooth-")
+        os.close(fd)
+        try:
+            image.save(path, quality=95)
+            command = ["lp", "-t", document_name]
+            if printer_name:
+                command += ["-d", printer_name]
+            for option in self.options:
+                command += ["-o", option]
+            command.append(path)
+            print("Printing...")
+            result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+            if result.returncode != 0:
+                raise RuntimeError(f"lp failed: {result.stderr.strip()}")
+        finally:
+            os.remove(path)
+
+
+class FilePrintBackend(PrintBackend):
+    # Writes every print to a file instead, for testing without a printer
+    def __init__(self, directory="prints", format="PDF"):
+        self.directory = directory
+        self.format = format
+
+    def print_image(self, image, document_name, printer_name=None):
+        os.makedirs(self.directory, exist_ok=True)
+        name = "".join(c if c.isalnum() else "_" for c in document_name)
+        extension = self.format.lower().replace("jpeg", "jpg")
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}_{name}.{extension}")
+        image.save(path, self.format)
+        print(f"Printed to {path}")
+
+
+def create_backend(name, printer_name=None):
+    if name == "win32":
+        return Win32PrintBackend(printer_name)
+    if name == "lp":
+        return LpPrintBackend(printer_name)
+    if name == "file":
+        return FilePrintBackend()
+    raise ValueError(f"Unknown print backend: {name}")
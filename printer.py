@@ -1,14 +1,23 @@
 from PIL import Image
-import win32print
-import win32ui
-from PIL import ImageWin
 import os
+import threading
+
+from imagestore import ImageStore
+from print_backends import Win32PrintBackend
 
 
 class ImagePrinter:
     def __init__(
-        self, margin_left=80, margin_top=52, image_size=(512, 512), printer_name=None
+        self,
+        margin_left=80,
+        margin_top=52,
+        image_size=(512, 512),
+        printer_name=None,
+        image_store=None,
+        backend=None,
     ):
+        self.image_store = image_store or ImageStore()
+        self.backend = backend or Win32PrintBackend(printer_name)
         self.margin_left = margin_left
         self.margin_top = margin_top
         self.image_size = image_size
@@ -18,134 +27,120 @@ class ImagePrinter:
         self.logo = self.logo.resize(
             (int(image_size[1] * self.logo.width / self.logo.height), image_size[1])
         )
-
-    def compose(self, orig1, orig2, orig3, gen1, gen2, gen3):
-        # Open the images
-        orig_imgs = []
-        gen_imgs = []
-        for img_path in [orig1, orig2, orig3]:
-            img_path = self.normalize_path(img_path)
+        self.logo_rotated = self.logo.rotate(180)
+        self.template = self.build_template()
+
+        # session -> {"image": strip, "takes": set of takes pasted so far}
+        self.strips = {}
+        self.lock = threading.Lock()
+
+    def open_image(self, img):
+        # Images from the store are used as they are, paths are opened
+        if isinstance(img, Image.Image):
+            return img
+        if img is not None:
+            img_path = self.normalize_path(img)
             if os.path.exists(img_path):
-                orig_imgs.append(Image.open(img_path))
-            else:
-                print(f"Warning: Image not found: {img_path}")
-                orig_imgs.append(Image.new("RGB", self.image_size, color="white"))
-        
-        for img_path in [gen1, gen2, gen3]:
-            img_path = self.normalize_path(img_path)
-            if os.path.exists(img_path):
-                gen_imgs.append(Image.open(img_path))
-            else:
-                print(f"Warning: Image not found: {img_path}")
-                gen_imgs.append(Image.new("RGB", self.image_size, color="white"))
-
-        # Resize the images
-        orig_imgs = [img.resize(self.image_size) for img in orig_imgs]
-        gen_imgs = [img.resize(self.image_size) for img in gen_imgs]
+                return Image.open(img_path)
+        print(f"Warning: Image not found: {img}")
+        return Image.new("RGB", self.image_size, color="white")
+
+    def build_template(self):
+        # The strip with both logo columns already placed, built once
+        template = Image.new("RGB", (1181, 1748), color="white")
+        for i in range(3):
+            x, y = self.position(i)
+            template.paste(self.logo, (x - self.logo.width - 5, y), mask=self.logo)
+            template.paste(
+                self.logo_rotated,
+                (x + self.image_size[0] * 2 + 5, y),
+                mask=self.logo_rotated,
+            )
+        return template
 
-        # Create a new image with the desired size
-        new_img = Image.new("RGB", (1181, 1748), color="white")
+    def position(self, i):
+        return (
+            self.margin_left,
+            self.margin_top + i * (self.image_size[1] + self.margin_top),
+        )
 
-        # Calculate the positions to paste the images
-        pos_list = [
-            (
-                self.margin_left,
-                self.margin_top + i * (self.image_size[1] + self.margin_top),
-            )
-            for i in range(3)
-        ]
-
-        # Paste the images and logos
-        for i, (orig_img, gen_img) in enumerate(zip(orig_imgs, gen_imgs)):
-            new_img.paste(
-                self.logo,
-                (pos_list[i][0] - self.logo.width - 5, pos_list[i][1]),
-                mask=self.logo,
-            )
-            new_img.paste(orig_img, pos_list[i])
-            new_img.paste(
-                gen_img, (pos_list[i][0] + self.image_size[0], pos_list[i][1])
-            )
-            new_img.paste(
-                self.logo.rotate(180),
-                (pos_list[i][0] + self.image_size[0] * 2 + 5, pos_list[i][1]),
-                mask=self.logo.rotate(180),
-            )
+    def paste_take(self, strip, i, orig_img, gen_img):
+        x, y = self.position(i)
+        for img, left in [(orig_img, x), (gen_img, x + self.image_size[0])]:
+            img = self.open_image(img)
+            if img.size != self.image_size:
+                img = img.resize(self.image_size)
+            strip.paste(img, (left, y))
+
+    def add_take(self, session, take, orig_img, gen_img):
+        # Called as soon as a take is generated, so the strip is ready to print
+        # when the last one finishes
+        with self.lock:
+            strip = self.strips.get(session)
+            if strip is None:
+                strip = {"image": self.template.copy(), "takes": set()}
+                self.strips[session] = strip
+                while len(self.strips) > 2:
+                    self.strips.pop(next(iter(self.strips)))
+            self.paste_take(strip["image"], take - 1, orig_img, gen_img)
+            strip["takes"].add(take)
 
+    def compose(self, orig1, orig2, orig3, gen1, gen2, gen3):
+        new_img = self.template.copy()
+        for i, (orig_img, gen_img) in enumerate(
+            [(orig1, gen1), (orig2, gen2), (orig3, gen3)]
+        ):
+            self.paste_take(new_img, i, orig_img, gen_img)
         return new_img
 
     def normalize_path(self, path):
         return os.path.normpath(path.replace('\\', '/'))
 
-    def print_image(self, image_path, printer_name=None):
-        image_path = self.normalize_path(image_path)
-        if not os.path.exists(image_path):
-            print(f"Error: Image not found: {image_path}")
-            return
-
-        img = Image.open(image_path).rotate(90, expand=True)
-
-        # Get the printer name
-        if printer_name is None:
-            if self.printer_name is None:
-                print("Using default printer...")
-                printer_name = win32print.GetDefaultPrinter()
+    def print_image(self, image, printer_name=None, document_name="Photobooth"):
+        if isinstance(image, str):
+            image_path = self.normalize_path(image)
+            if not os.path.exists(image_path):
+                print(f"Error: Image not found: {image_path}")
+                return
+            image = Image.open(image_path)
+            document_name = image_path
+
+        self.backend.print_image(image, document_name, printer_name)
+
+    def composition(self, session):
+        with self.lock:
+            strip = self.strips.get(session)
+            if strip is not None and strip["takes"] == {1, 2, 3}:
+                composition = strip["image"].copy()
             else:
-                printer_name = self.printer_name
-
-        hprinter = win32print.OpenPrinter(printer_name)
-
-        try:
-            print("Printing...")
-            hdc = win32ui.CreateDC()
-            hdc.CreatePrinterDC(printer_name)
-            hdc.StartDoc(image_path)
-            hdc.StartPage()
-
-            # Get the printer surface size
-            printer_surface_width = hdc.GetDeviceCaps(8)  # HORZRES
-            printer_surface_height = hdc.GetDeviceCaps(10)  # VERTRES
-
-            # Calculate the position to center the image
-            x = (printer_surface_width - img.width) // 2
-            y = (printer_surface_height - img.height) // 2
-
-            dib = ImageWin.Dib(img)
-            dib.draw(
-                hdc.GetHandleOutput(),
-                (x, y, x + img.width, y + img.height),
-            )
-
-            hdc.EndPage()
-            hdc.EndDoc()
-            hdc.DeleteDC()
-        finally:
-            win32print.ClosePrinter(hprinter)
+                composition = None
+
+        if composition is None:
+            # Reprints of older sessions are composed from the stored images
+            images = [
+                self.image_store.get(session, name)
+                for name in ["1", "2", "3", "1_generated", "2_generated", "3_generated"]
+            ]
+            if not any(image is not None for image in images):
+                print(f"Error: Session not found: {session}")
+                return None
+            composition = self.compose(*images)
+
+        # Saved in the background, the printer gets the image straight away
+        self.image_store.put(session, "composition", composition)
+        return composition
 
     def print_session(self, session):
-        session_dir = self.normalize_path(f"sessions/{session}")
-        if not os.path.exists(session_dir):
-            print(f"Error: Session directory not found: {session_dir}")
-            return
-
-        composition = self.compose(
-            os.path.join(session_dir, "1.jpg"),
-            os.path.join(session_dir, "2.jpg"),
-            os.path.join(session_dir, "3.jpg"),
-            os.path.join(session_dir, "1_generated.jpg"),
-            os.path.join(session_dir, "2_generated.jpg"),
-            os.path.join(session_dir, "3_generated.jpg"),
-        )
-
-        composition_path = os.path.join(session_dir, "composition.jpg")
-        composition.save(composition_path)
-        self.print_image(composition_path, self.printer_name)
+        composition = self.composition(session)
+        if composition is not None:
+            self.print_image(composition, self.printer_name, f"Photobooth session {session}")
 
 
 def main():
     generator = ImagePrinter()
 
-    generator.print_session(1718651223)
+    generator.print_session("1718651223")
+    generator.image_store.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,41 @@
+import base64
+import json
+
+# Messages are JSON objects, one per line. Images travel as base64 encoded
+# file contents so they are never decoded on the way. The id is chosen by the
+# client and echoed back on every message about that job.
+#
+#   client -> server  {"type": "submit", "id": 1, "image": "<base64>", "prompt": null,
+#                      "booth": "booth-1", "waiting": false}
+#   client -> server  {"type": "waiting", "id": 1}
+#   client -> server  {"type": "cancel", "id": 1}
+#   server -> client  {"type": "queue", "depth": 5, "positions": {"1": 2}}
+#   server -> client  {"type": "progress", "id": 1,
+#                      "progress": {"step": 12, "total": 25, "phase": "denoise"}}
+#   server -> client  {"type": "result", "id": 1, "image": "<base64>",
+#                      "prompt": "...", "caption": "..."}
+#   server -> client  {"type": "cancelled", "id": 1}
+#   server -> client  {"type": "error", "id": 1, "error": "..."}
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5005
+
+
+def send_message(stream, message):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def read_message(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def encode_image(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def decode_image(data):
+    return base64.b64decode(data)
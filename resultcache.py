@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from fileutils import write_atomic
+
+
+# Disk-backed cache of generated images, keyed by a hash of everything that
+# goes into a generation. Least recently used entries are evicted once the
+# cache grows past max_bytes.
+class ResultCache:
+    def __init__(self, directory="cache", max_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> size in bytes, least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".png") and ".tmp" not in name:
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key(image, params):
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode} {image.size}".encode("utf-8"))
+        digest.update(image.tobytes())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        path = self.path(key)
+        try:
+            image = Image.open(path)
+            image.load()
+            os.utime(path)  # Keeps the LRU order across restarts
+        except OSError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return image
+
+    def put(self, key, image):
+        path = self.path(key)
+        # PNG so a cached result is exactly what the model produced
+        write_atomic(path, image.save)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self.path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
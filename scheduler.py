@@ -0,0 +1,90 @@
+import queue
+import threading
+from collections import OrderedDict, deque
+
+
+def _pick(booths):
+    # Booths take turns, one job each. Booths with a user watching the
+    # progress bar go before the ones still in the confirmation countdown.
+    booth = next((booth for booth, jobs in booths.items() if any(job.waiting for job in jobs)), None)
+    if booth is None:
+        booth = next(iter(booths))
+    jobs = booths.pop(booth)
+    job = next((job for job in jobs if job.waiting), jobs[0])
+    jobs.remove(job)
+    if jobs:
+        booths[booth] = jobs  # Back of the line
+    return job
+
+
+# Drop-in replacement for the worker's queue.Queue when several booths share
+# one generation server: jobs are queued per job.booth and handed out round
+# robin instead of first come, first served.
+class FairJobQueue:
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.booths = OrderedDict()  # booth -> deque of jobs, in turn order
+        self.condition = threading.Condition()
+        self.stopping = False
+        # Called after every put and get, e.g. to report queue positions
+        self.on_change = None
+
+    def qsize(self):
+        with self.condition:
+            return sum(len(jobs) for jobs in self.booths.values())
+
+    def put_nowait(self, job):
+        with self.condition:
+            if job is None:
+                # Like the worker's stop sentinel: jobs already queued still run
+                self.stopping = True
+                self.condition.notify_all()
+                return
+            if self.maxsize and sum(len(jobs) for jobs in self.booths.values()) >= self.maxsize:
+                raise queue.Full
+            self.booths.setdefault(job.booth, deque()).append(job)
+            self.condition.notify()
+        self._changed()
+
+    def get(self):
+        with self.condition:
+            while not self.booths and not self.stopping:
+                self.condition.wait()
+            job = _pick(self.booths) if self.booths else None
+        self._changed()
+        return job
+
+    def get_nowait(self):
+        with self.condition:
+            if not self.booths:
+                if self.stopping:
+                    return None
+                raise queue.Empty
+            job = _pick(self.booths)
+        self._changed()
+        return job
+
+    def discard_cancelled(self):
+        with self.condition:
+            for booth in list(self.booths):
+                jobs = deque(job for job in self.booths[booth] if not job.cancelled())
+                if jobs:
+                    self.booths[booth] = jobs
+                else:
+                    del self.booths[booth]
+        self._changed()
+
+    def order(self):
+        # Queued jobs in the order they would run if nothing else arrived
+        with self.condition:
+            booths = OrderedDict((booth, deque(jobs)) for booth, jobs in self.booths.items())
+        jobs = []
+        while booths:
+            job = _pick(booths)
+            if not job.cancelled():
+                jobs.append(job)
+        return jobs
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
@@ -0,0 +1,213 @@
+import argparse
+import io
+import socketserver
+import threading
+import time
+
+from PIL import Image
+
+from protocol import (
+    DEFAULT_HOST,
+    DEFAULT_PORT,
+    decode_image,
+    encode_image,
+    read_message,
+    send_message,
+)
+from scheduler import FairJobQueue
+from worker import GenerationJob, GenerationWorker
+
+
+class GenerationRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.send_lock = threading.Lock()
+        self.jobs = {}
+        with self.server.handlers_lock:
+            self.server.handlers.add(self)
+        try:
+            while True:
+                try:
+                    request = read_message(self.rfile)
+                except OSError:
+                    # Clients hang up as soon as they have their result, often
+                    # with queue reports still unread, so a reset is a normal
+                    # disconnect
+                    return
+                except ValueError as e:
+                    self.send({"type": "error", "error": f"Invalid message: {e}"})
+                    return
+                if request is None:
+                    return
+                if request.get("type") == "submit":
+                    self.handle_submit(request)
+                elif request.get("type") == "cancel":
+                    job = self.jobs.get(request.get("id"))
+                    if job:
+                        job.cancel()
+                        # Jobs behind it move up
+                        self.server.queue_changed.set()
+                elif request.get("type") == "waiting":
+                    # The user is now watching the progress bar
+                    job = self.jobs.get(request.get("id"))
+                    if job:
+                        job.set_waiting()
+                        self.server.queue_changed.set()
+                else:
+                    self.send({"type": "error", "error": f"Unknown request: {request.get('type')}"})
+        finally:
+            with self.server.handlers_lock:
+                self.server.handlers.discard(self)
+            # Nobody is left to receive the results, free the worker
+            for job in list(self.jobs.values()):
+                job.cancel()
+
+    def send(self, message):
+        # Progress is sent from the worker thread, results from a waiter thread
+        with self.send_lock:
+            send_message(self.wfile, message)
+
+    def handle_submit(self, request):
+        job_id = request.get("id")
+        image = Image.open(io.BytesIO(decode_image(request["image"])))
+
+        def send_progress(progress):
+            try:
+                self.send({"type": "progress", "id": job_id, "progress": vars(progress)})
+            except OSError:
+                pass  # The client went away, the job gets cancelled
+
+        job = self.server.worker.submit(
+            image,
+            request.get("prompt"),
+            on_progress=send_progress,
+            name=f"{self.client_address[0]}#{job_id}",
+            # Booths behind the same address tell themselves apart by name
+            booth=request.get("booth") or self.client_address[0],
+            waiting=request.get("waiting", False),
+        )
+        self.jobs[job_id] = job
+        threading.Thread(
+            target=self.send_result, args=(job_id, job), daemon=True
+        ).start()
+
+    def send_result(self, job_id, job):
+        job.wait()
+        try:
+            if job.status == GenerationJob.CANCELLED:
+                self.send({"type": "cancelled", "id": job_id})
+            elif job.status == GenerationJob.FAILED:
+                self.send({"type": "error", "id": job_id, "error": str(job.error)})
+            else:
+                result = io.BytesIO()
+                job.result.save(result, "JPEG")
+                self.send(
+                    {
+                        "type": "result",
+                        "id": job_id,
+                        "image": encode_image(result.getvalue()),
+                        "prompt": job.result.info.get("prompt"),
+                        "caption": job.result.info.get("caption"),
+                    }
+                )
+        except OSError:
+            pass
+        finally:
+            self.jobs.pop(job_id, None)
+
+
+# Several booths can share one server. Their jobs are scheduled round robin
+# per booth (see scheduler.py) and every booth is told the queue depth and the
+# position of its jobs whenever the queue changes.
+class GenerationServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        image_generator,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        max_batch=1,
+        max_pending=32,
+    ):
+        super().__init__((host, port), GenerationRequestHandler)
+        self.handlers = set()
+        self.handlers_lock = threading.Lock()
+        self.queue_changed = threading.Event()
+        self.job_queue = FairJobQueue(max_pending)
+        self.job_queue.on_change = self.queue_changed.set
+        self.worker = GenerationWorker(
+            image_generator, max_batch=max_batch, job_queue=self.job_queue
+        )
+        threading.Thread(target=self._report_queue, daemon=True).start()
+
+    def _report_queue(self):
+        # Runs on its own thread, a slow booth never holds up the worker
+        while True:
+            self.queue_changed.wait()
+            self.queue_changed.clear()
+            order = {id(job): position for position, job in enumerate(self.job_queue.order())}
+            with self.handlers_lock:
+                handlers = list(self.handlers)
+            for handler in handlers:
+                positions = {
+                    job_id: order[id(job)]
+                    for job_id, job in list(handler.jobs.items())
+                    if id(job) in order
+                }
+                try:
+                    handler.send({"type": "queue", "depth": len(order), "positions": positions})
+                except OSError:
+                    pass
+            time.sleep(0.05)  # Coalesces bursts of changes into one report
+
+    def server_close(self):
+        super().server_close()
+        self.worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Photobooth generation server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--stub", action="store_true", help="Use the CPU-only stub backend"
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=1,
+        help="Run up to this many queued jobs as one batch",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=32,
+        help="Jobs that can wait in the queue, across all booths",
+    )
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_generator import StubImageGenerator
+
+        image_generator = StubImageGenerator()
+    else:
+        from generate import ImageGenerator
+        from resultcache import ResultCache
+
+        image_generator = ImageGenerator(warmup=True, cache=ResultCache())
+
+    server = GenerationServer(
+        image_generator, args.host, args.port, args.max_batch, args.max_pending
+    )
+    print(f"Generation server listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
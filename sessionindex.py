@@ -0,0 +1,213 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    booth TEXT,
+    printed REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE TABLE IF NOT EXISTS takes (
+    session TEXT NOT NULL,
+    take INTEGER NOT NULL,
+    prompt TEXT,
+    caption TEXT,
+    status TEXT,
+    updated REAL,
+    PRIMARY KEY (session, take)
+);
+CREATE TABLE IF NOT EXISTS files (
+    session TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    written REAL,
+    PRIMARY KEY (session, name)
+);
+CREATE TABLE IF NOT EXISTS timings (
+    session TEXT NOT NULL,
+    take INTEGER,
+    stage TEXT NOT NULL,
+    start REAL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_session ON timings (session, take);
+"""
+
+
+# SQLite index of sessions/: which sessions exist, their takes and prompts,
+# where every image was archived and how long each stage took. Reprints and
+# galleries look sessions up by key instead of scanning the folder. One
+# connection is shared by all threads, behind a lock.
+class SessionIndex:
+    def __init__(self, path=os.path.join("sessions", "index.db")):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            # WAL lets the reprint tool read while the booth writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+
+    def new_session(self, booth=None):
+        # Ids are still the start time in seconds, with a -2, -3... suffix if
+        # another session already started in the same second
+        started = time.time()
+        base = str(int(started))
+        with self.lock, self.db:
+            for attempt in range(1, 1000):
+                session = base if attempt == 1 else f"{base}-{attempt}"
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO sessions (id, started, booth) VALUES (?, ?, ?)",
+                    (session, started, booth),
+                )
+                if cursor.rowcount:
+                    return session
+        raise RuntimeError(f"No free session id for {base}")
+
+    def _ensure_session(self, session, started=None):
+        self.db.execute(
+            "INSERT OR IGNORE INTO sessions (id, started) VALUES (?, ?)",
+            (str(session), started or time.time()),
+        )
+
+    def add_file(self, session, name, path):
+        with self.lock, self.db:
+            self._ensure_session(session)
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (session, name, path, written) VALUES (?, ?, ?, ?)",
+                (str(session), name, path, time.time()),
+            )
+
+    def set_take(self, session, take, prompt=None, caption=None, status=None):
+        with self.lock, self.db:
+            self._ensure_session(session)
+            self.db.execute(
+                "INSERT OR REPLACE INTO takes (session, take, prompt, caption, status, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (str(session), take, prompt, caption, status, time.time()),
+            )
+
+    def add_timing(self, session, take, stage, seconds, start=None):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO timings (session, take, stage, start, seconds) VALUES (?, ?, ?, ?, ?)",
+                (str(session), take, stage, start, seconds),
+            )
+
+    def mark_printed(self, session):
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE sessions SET printed = ? WHERE id = ?", (time.time(), str(session))
+            )
+
+    def file(self, session, name):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT path FROM files WHERE session = ? AND name = ?", (str(session), name)
+            ).fetchone()
+        return row["path"] if row else None
+
+    def session(self, session):
+        # Everything about one session, or None if it isn't indexed
+        with self.lock:
+            row = self.db.execute("SELECT * FROM sessions WHERE id = ?", (str(session),)).fetchone()
+            if row is None:
+                return None
+            takes = self.db.execute(
+                "SELECT * FROM takes WHERE session = ? ORDER BY take", (str(session),)
+            ).fetchall()
+            files = self.db.execute(
+                "SELECT name, path FROM files WHERE session = ?", (str(session),)
+            ).fetchall()
+            timings = self.db.execute(
+                "SELECT take, stage, seconds FROM timings WHERE session = ? ORDER BY start",
+                (str(session),),
+            ).fetchall()
+        return {
+            **dict(row),
+            "takes": [dict(take) for take in takes],
+            "files": {file["name"]: file["path"] for file in files},
+            "timings": [dict(timing) for timing in timings],
+        }
+
+    def recent_sessions(self, limit=20, offset=0):
+        # Newest first, a page at a time, e.g. for a gallery
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM sessions ORDER BY started DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def rebuild(self, root="sessions"):
+        # One scan of sessions/ to index archives from before the index existed
+        count = 0
+        for session in sorted(os.listdir(root)):
+            directory = os.path.join(root, session)
+            if not os.path.isdir(directory):
+                continue
+            started = int(session.split("-")[0]) if session.split("-")[0].isdigit() else None
+            with self.lock, self.db:
+                self._ensure_session(session, started or os.path.getmtime(directory))
+                for filename in os.listdir(directory):
+                    name, ext = os.path.splitext(filename)
+                    if ext.lower() != ".jpg" or ".tmp" in name:
+                        continue
+                    self.db.execute(
+                        "INSERT OR IGNORE INTO files (session, name, path, written) VALUES (?, ?, ?, ?)",
+                        (session, name, os.path.join(directory, filename), None),
+                    )
+            count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up sessions in the session index")
+    parser.add_argument("--index", default=os.path.join("sessions", "index.db"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    recent = commands.add_parser("list", help="Most recent sessions")
+    recent.add_argument("--limit", type=int, default=20)
+    show = commands.add_parser("show", help="Takes, prompts, files and timings of a session")
+    show.add_argument("session")
+    rebuild = commands.add_parser("rebuild", help="Index session folders made before the index")
+    rebuild.add_argument("--root", default="sessions")
+    args = parser.parse_args()
+
+    index = SessionIndex(args.index)
+    if args.command == "list":
+        for session in index.recent_sessions(args.limit):
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session["started"]))
+            printed = "printed" if session["printed"] else ""
+            print(f"{session['id']:<16}{started}  {session['booth'] or '':<12}{printed}")
+    elif args.command == "show":
+        session = index.session(args.session)
+        if session is None:
+            print(f"Error: Session not found: {args.session}")
+            return
+        for take in session["takes"]:
+            print(f"Take {take['take']}: {take['caption']} ({take['status']}) {take['prompt']}")
+        for name, path in sorted(session["files"].items()):
+            print(f"  {name:<14}{path}")
+        for timing in session["timings"]:
+            take = "" if timing["take"] is None else timing["take"]
+            print(f"  {timing['stage']:<14}{take!s:<4}{timing['seconds'] * 1000:>8.1f} ms")
+    else:
+        print(f"Indexed {index.rebuild(args.root)} sessions")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
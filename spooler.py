@@ -0,0 +1,225 @@
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from fileutils import write_atomic
+from metrics import metrics
+
+
+class PrintJob:
+    PENDING = "pending"
+    PRINTING = "printing"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, id, session, attempts=0, created=None):
+        self.id = id
+        self.session = session
+        self.status = self.PENDING
+        self.attempts = attempts
+        self.error = None
+        self.created = created or time.time()
+        self.finished_time = None
+        self.finished = threading.Event()
+
+    def latency(self):
+        if self.finished_time is None:
+            return None
+        return self.finished_time - self.created
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+
+# Prints sessions on a background thread, so composing the strip and talking
+# to the printer never block the booth. Every job is written to
+# print_queue/<id>.json until it has printed, so a crash or restart doesn't
+# lose prints. Jobs that keep failing are kept as <id>.failed.json.
+class PrintSpooler:
+    def __init__(
+        self, printer, queue_dir="print_queue", max_retries=3, retry_delay=5, index=None
+    ):
+        self.printer = printer
+        # Optional SessionIndex, printed sessions are marked in it
+        self.index = index
+        self.queue_dir = queue_dir
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.jobs = {}
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.printed = 0
+        self.failed = 0
+        self.latencies = []
+        self.start_time = time.time()
+
+        os.makedirs(queue_dir, exist_ok=True)
+        self._load()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _job_path(self, job, suffix=".json"):
+        return os.path.join(self.queue_dir, f"{job.id}{suffix}")
+
+    def _save(self, job):
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "session": job.session,
+                        "attempts": job.attempts,
+                        "created": job.created,
+                        "error": job.error,
+                    },
+                    f,
+                )
+
+        write_atomic(self._job_path(job), write)
+
+    def _load(self):
+        for path in sorted(glob.glob(os.path.join(self.queue_dir, "*.json"))):
+            id = os.path.basename(path)[: -len(".json")]
+            # Failed jobs, and write_atomic leftovers from a crash mid-write
+            if id.endswith(".failed") or ".tmp" in id:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error: Could not read print job {path}: {e}")
+                continue
+            job = PrintJob(
+                id, str(data["session"]), data.get("attempts", 0), data.get("created")
+            )
+            print(f"Resuming print job for session {job.session}")
+            self.jobs[id] = job
+            self.pending.put(job)
+
+    def submit(self, session):
+        with self.lock:
+            id = f"{int(time.time() * 1000)}_{session}"
+            while id in self.jobs:
+                id += "_"
+            job = PrintJob(id, session)
+            self.jobs[id] = job
+        self._save(job)
+        self.pending.put(job)
+        return job
+
+    def _run(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                break
+            self._print(job)
+
+    def _print(self, job):
+        while not self.stopping.is_set():
+            job.status = PrintJob.PRINTING
+            job.attempts += 1
+            try:
+                with metrics.span("compose", job.session):
+                    composition = self.printer.composition(job.session)
+                if composition is None:
+                    raise FileNotFoundError(f"Session not found: {job.session}")
+                with metrics.span("print", job.session, attempt=job.attempts):
+                    self.printer.print_image(
+                        composition, self.printer.printer_name, f"Photobooth session {job.session}"
+                    )
+            except Exception as e:
+                job.error = str(e)
+                print(f"Error: Print attempt {job.attempts} for session {job.session} failed: {e}")
+                if job.attempts >= self.max_retries:
+                    os.replace(self._job_path(job), self._job_path(job, ".failed.json"))
+                    self._finish(job, PrintJob.FAILED)
+                    return
+                self._save(job)
+                job.status = PrintJob.PENDING
+                self.stopping.wait(self.retry_delay)
+                continue
+
+            os.remove(self._job_path(job))
+            if self.index:
+                try:
+                    self.index.mark_printed(job.session)
+                except Exception as e:
+                    print(f"Warning: Could not mark session {job.session} as printed: {e}")
+            self._finish(job, PrintJob.DONE)
+            return
+
+    def _finish(self, job, status):
+        job.finished_time = time.time()
+        with self.lock:
+            job.status = status
+            if status == PrintJob.DONE:
+                self.printed += 1
+                self.latencies.append(job.latency())
+            else:
+                self.failed += 1
+        job.finished.set()
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.time() - self.start_time
+            return {
+                "printed": self.printed,
+                "failed": self.failed,
+                "pending": self.pending.qsize(),
+                "prints_per_minute": self.printed / elapsed * 60 if elapsed else 0,
+                "mean_latency": sum(latencies) / len(latencies) if latencies else None,
+                "max_latency": latencies[-1] if latencies else None,
+            }
+
+    def stop(self, timeout=5):
+        # Unprinted jobs stay in the queue directory for the next start
+        self.stopping.set()
+        self.pending.put(None)
+        self.thread.join(timeout=timeout)
+
+
+def main():
+    from imagestore import ImageStore
+    from print_backends import create_backend
+    from printer import ImagePrinter
+    from sessionindex import SessionIndex
+
+    parser = argparse.ArgumentParser(description="Print sessions through the print spooler")
+    parser.add_argument("sessions", nargs="+", help="Session ids from the sessions/ folder")
+    parser.add_argument("--backend", choices=["win32", "lp", "file"], default="file")
+    parser.add_argument("--printer", help="Printer name, the system default if not given")
+    parser.add_argument("--copies", type=int, default=1, help="Print every session this many times")
+    args = parser.parse_args()
+
+    index = SessionIndex()
+    printer = ImagePrinter(
+        printer_name=args.printer,
+        image_store=ImageStore(index=index),
+        backend=create_backend(args.backend, args.printer),
+    )
+    spooler = PrintSpooler(printer, retry_delay=1, index=index)
+    jobs = [
+        spooler.submit(session) for session in args.sessions for _ in range(args.copies)
+    ]
+    for job in jobs:
+        job.wait()
+    spooler.stop()
+    printer.image_store.flush()
+    metrics.flush()
+
+    stats = spooler.stats()
+    print(
+        f"Printed {stats['printed']}, failed {stats['failed']}, "
+        f"{stats['prints_per_minute']:.1f} prints per minute"
+    )
+    if stats["mean_latency"] is not None:
+        print(f"Latency mean {stats['mean_latency']:.2f}s, max {stats['max_latency']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
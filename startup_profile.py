@@ -0,0 +1,83 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Collects import and init timings for --profile-startup. Spans are always
+# recorded (they are cheap), imports only once enable_import_timing() is called.
+class StartupProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports = []  # (depth, module, seconds)
+        self.spans = []  # (name, seconds)
+        self.marks = []  # (name, seconds since start)
+        self.import_depth = 0
+        self.original_import = None
+
+    def enable_import_timing(self):
+        if self.original_import is not None:
+            return
+        self.original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def disable_import_timing(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Only first imports on the main thread are timed, the rest are lookups
+        if (
+            level != 0
+            or name in sys.modules
+            or threading.current_thread() is not threading.main_thread()
+        ):
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        entry = [self.import_depth, name, 0]
+        self.imports.append(entry)
+        self.import_depth += 1
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            entry[2] = time.perf_counter() - start
+            self.import_depth -= 1
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter() - self.start))
+
+    def report(self, target=None, max_depth=1):
+        lines = ["Startup profile"]
+        if self.imports:
+            total = sum(seconds for depth, _, seconds in self.imports if depth == 0)
+            lines.append(f"  imports{total * 1000:>35.1f} ms")
+            for depth, name, seconds in self.imports:
+                if depth <= max_depth:
+                    indent = "  " * (depth + 2)
+                    lines.append(f"{indent}{name:<{38 - len(indent)}}{seconds * 1000:>8.1f} ms")
+        if self.spans:
+            total = sum(seconds for _, seconds in self.spans)
+            lines.append(f"  init{total * 1000:>38.1f} ms")
+            for name, seconds in self.spans:
+                lines.append(f"    {name:<34}{seconds * 1000:>8.1f} ms")
+        for name, seconds in self.marks:
+            line = f"  {name:<36}{seconds * 1000:>8.1f} ms"
+            if target is not None and name == "first frame":
+                status = "ok" if seconds <= target else "OVER TARGET"
+                line += f" (target {target * 1000:.0f} ms, {status})"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+profile = StartupProfile()
@@ -0,0 +1,102 @@
+import time
+from types import SimpleNamespace
+
+from PIL import Image, ImageFilter, ImageOps
+
+from worker import GenerationCancelled, GenerationProgress
+
+
+def stylize(image):
+    return ImageOps.posterize(image.filter(ImageFilter.SMOOTH_MORE), 3)
+
+
+# CPU-only stand-in for ImageGenerator, for testing without a GPU
+class StubImageGenerator:
+    def __init__(self, steps=30, step_time=0.05):
+        self.steps = steps
+        self.step_time = step_time
+
+    def generate_batch(self, jobs):
+        results = []
+        for image, forced_prompt, callback, token in jobs:
+            try:
+                results.append(self.generate(image, forced_prompt, callback, token))
+            except GenerationCancelled:
+                results.append(None)
+        return results
+
+    def generate(self, image, forced_prompt=None, callback=None, token=None):
+        if isinstance(image, str):
+            image = Image.open(image)
+        image = image.convert("RGB")
+        width, height = image.size
+        new_size = min(width, height)
+        left = (width - new_size) / 2
+        top = (height - new_size) / 2
+        image = image.crop((left, top, left + new_size, top + new_size))
+        image.thumbnail((512, 512))
+
+        for step in range(1, self.steps + 1):
+            time.sleep(self.step_time)
+            if token:
+                token.check()
+            if callback:
+                callback(GenerationProgress(step, self.steps, GenerationProgress.DENOISE))
+        if callback:
+            callback(GenerationProgress(self.steps, self.steps, GenerationProgress.FINISH))
+
+        result = stylize(image)
+        result.info["prompt"] = forced_prompt or "posterized"
+        result.info["caption"] = (forced_prompt or "Stub").upper()
+        if token:
+            token.check()
+        return result
+
+
+class StubImaginePrompt:
+    def __init__(self, init_image=None, init_image_strength=0, steps=30, **settings):
+        self.init_image = init_image
+        self.init_image_strength = init_image_strength
+        self.steps = steps
+        self.model_weights = None
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+
+# CPU-only stand-in for imaginAIry behind the real ImageGenerator, so prompt
+# selection, preprocessing, cache keys and batching run as they do on the GPU
+class StubImagineBackend:
+    def __init__(self, steps=30, step_time=0.05):
+        self.steps = steps
+        self.step_time = step_time
+
+    def load(self):
+        pass
+
+    def schema(self):
+        def imagine_prompt(**settings):
+            return StubImaginePrompt(steps=self.steps, **settings)
+
+        return SimpleNamespace(
+            ImaginePrompt=imagine_prompt,
+            ControlInput=SimpleNamespace,
+            MaskMode=SimpleNamespace(KEEP="keep"),
+        )
+
+    def imagine(self, prompts, debug_img_callback):
+        for prompt in prompts:
+            # img2img skips the first init_image_strength of the steps
+            steps = prompt.steps - int(prompt.steps * prompt.init_image_strength)
+            for step in range(1, steps + 1):
+                time.sleep(self.step_time)
+                debug_img_callback(None, "noise", 1, step, prompt)
+            yield SimpleNamespace(img=stylize(prompt.init_image.convert("RGB")))
+
+    def install_conditioning(self, conditioning):
+        return False
+
+    def create_depth_map(self, image):
+        return None
+
+    def create_face_mask(self, image, mask_prompt):
+        return None
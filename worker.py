@@ -0,0 +1,375 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    def __init__(self):
+        self.requested_at = None
+        self.observed_at = None
+
+    def cancel(self):
+        if self.requested_at is None:
+            self.requested_at = time.time()
+
+    def cancelled(self):
+        return self.requested_at is not None
+
+    def check(self):
+        # Called by the generator at step boundaries and before writing output
+        if self.requested_at is not None:
+            self.observe()
+            raise GenerationCancelled()
+
+    def observe(self):
+        if self.observed_at is None:
+            self.observed_at = time.time()
+
+    def latency(self):
+        if self.requested_at is None or self.observed_at is None:
+            return None
+        return self.observed_at - self.requested_at
+
+
+class GenerationProgress:
+    QUEUED = "queued"
+    DENOISE = "denoise"  # step counts the denoising steps done so far
+    FINISH = "finish"  # All steps done, decoding and captioning the image
+    LOADING = "loading"  # Loading the model, step counts percent of the load
+
+    def __init__(self, step=0, total=0, phase=QUEUED):
+        self.step = step
+        self.total = total
+        self.phase = phase
+
+    def fraction(self):
+        if not self.total:
+            return 0
+        return min(1, self.step / self.total)
+
+
+# The worker's default first come, first served queue
+class JobQueue(queue.Queue):
+    def discard_cancelled(self):
+        # Cancelled jobs wait for the worker like any other, so retakes while
+        # the model loads could fill the queue with jobs nobody wants
+        with self.mutex:
+            self.queue = deque(job for job in self.queue if job is None or not job.cancelled())
+            self.not_full.notify_all()
+
+
+class GenerationJob:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(
+        self, image, forced_prompt=None, on_progress=None, name=None, booth=None, waiting=False
+    ):
+        # image is a PIL image or a path, result is a PIL image
+        self.image = image
+        self.name = name or (image if isinstance(image, str) else "image")
+        self.forced_prompt = forced_prompt
+        self.on_progress = on_progress
+        # Which booth the job came from and whether its user is already
+        # watching the progress bar, for scheduling on a shared server
+        self.booth = booth
+        self.waiting = waiting
+        self.on_waiting = None
+        # Called after cancel(), e.g. to tell a generation server right away
+        self.on_cancel = None
+        # Jobs ahead of this one, when the server reports it
+        self.queue_position = None
+        self.status = self.PENDING
+        self.progress = GenerationProgress()
+        self.result = None
+        self.error = None
+        self.token = CancellationToken()
+        # Future for the generator's preprocess(image), if the worker started one
+        self.preprocessed = None
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.done_callbacks = []
+        # Wall clock times of the job's stages, for metrics
+        self.submitted_time = time.time()
+        self.started_time = None
+        self.finished_time = None
+        self.preprocess_seconds = None
+        self.first_step_time = None
+        self.last_step_time = None
+
+    def update_progress(self, progress):
+        # Called by the generator with a GenerationProgress
+        with self.lock:
+            self.progress = progress
+            if progress.phase == GenerationProgress.DENOISE:
+                self.last_step_time = time.time()
+                if self.first_step_time is None:
+                    self.first_step_time = self.last_step_time
+        if self.on_progress:
+            self.on_progress(progress)
+
+    def set_waiting(self):
+        with self.lock:
+            if self.waiting:
+                return
+            self.waiting = True
+            on_waiting = self.on_waiting
+        if on_waiting:
+            on_waiting(self)
+
+    def set_running(self, started=True):
+        # started=False for jobs queued elsewhere, they call set_started()
+        # once they actually leave that queue
+        with self.lock:
+            if self.status == self.CANCELLED:
+                return False
+            self.status = self.RUNNING
+            if started:
+                self.started_time = time.time()
+            return True
+
+    def set_started(self):
+        with self.lock:
+            if self.started_time is None:
+                self.started_time = time.time()
+
+    def set_result(self, result):
+        with self.lock:
+            if self.status == self.CANCELLED:
+                return
+            self.result = result
+            self.status = self.DONE
+        self._finish()
+
+    def set_error(self, error):
+        with self.lock:
+            if self.status == self.CANCELLED:
+                return
+            self.error = error
+            self.status = self.FAILED
+        self._finish()
+
+    def cancel(self):
+        with self.lock:
+            if self.finished.is_set():
+                return False
+            self.status = self.CANCELLED
+            on_cancel = self.on_cancel
+        self.token.cancel()
+        self._finish()
+        if on_cancel:
+            on_cancel(self)
+        return True
+
+    def add_done_callback(self, callback):
+        # Called with the job once it is done, failed or cancelled, on whichever
+        # thread finished it. Called right away if that already happened.
+        with self.lock:
+            if not self.finished.is_set():
+                self.done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self):
+        with self.lock:
+            self.finished_time = time.time()
+            self.finished.set()
+            callbacks, self.done_callbacks = self.done_callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Error: Done callback failed for {self.name}: {e}")
+
+    def cancelled(self):
+        return self.status == self.CANCELLED
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+
+class GenerationWorker:
+    def __init__(
+        self,
+        image_generator=None,
+        max_pending=4,
+        max_batch=1,
+        create_generator=None,
+        job_queue=None,
+    ):
+        # Either pass a ready image_generator, or create_generator(callback) to
+        # build it on the worker thread. Jobs submitted while it loads wait in
+        # the queue.
+        self.image_generator = image_generator
+        self.create_generator = create_generator
+        self.load_error = None
+        self.loading_progress = GenerationProgress()
+        self.ready = threading.Event()
+        self.ready_time = None
+        if create_generator is None:
+            self.ready.set()
+        # With max_batch > 1, jobs that piled up in the queue run as one batch
+        self.max_batch = max_batch
+        # job_queue replaces the first come, first served queue, e.g. with a
+        # scheduler.FairJobQueue, and needs a discard_cancelled() method too
+        self.jobs = job_queue if job_queue is not None else JobQueue(maxsize=max_pending)
+        # Preprocessing (depth map, face mask) starts on submit, on its own
+        # thread, so it overlaps the confirmation countdown and earlier jobs
+        self.preprocessor = ThreadPoolExecutor(max_workers=1)
+        # Seconds from cancel() until the worker was free again, most recent last
+        self.cancel_latencies = deque(maxlen=100)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(
+        self, image, forced_prompt=None, on_progress=None, name=None, booth=None, waiting=False
+    ):
+        job = GenerationJob(image, forced_prompt, on_progress, name, booth, waiting)
+        job.preprocessed = self.preprocessor.submit(self._preprocess, job)
+        try:
+            try:
+                self.jobs.put_nowait(job)
+            except queue.Full:
+                # Cancelled jobs don't count against max_pending
+                self.jobs.discard_cancelled()
+                self.jobs.put_nowait(job)
+        except queue.Full:
+            job.set_error(RuntimeError("Generation queue is full"))
+            job.preprocessed.cancel()
+        return job
+
+    def _preprocess(self, job):
+        self.ready.wait()
+        if job.cancelled() or not hasattr(self.image_generator, "preprocess"):
+            return job.image
+        start = time.perf_counter()
+        image = self.image_generator.preprocess(job.image)
+        job.preprocess_seconds = time.perf_counter() - start
+        return image
+
+    def _job_image(self, job):
+        if job.preprocessed is None:
+            return job.image
+        try:
+            return job.preprocessed.result()
+        except Exception as e:
+            print(f"Warning: Preprocessing failed for {job.name}: {e}")
+            return job.image
+
+    def _next_batch(self):
+        batch = []
+        job = self.jobs.get()
+        while job is not None:
+            # Jobs cancelled while waiting in the queue are simply dropped
+            if job.set_running():
+                batch.append(job)
+            if len(batch) >= self.max_batch:
+                break
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+        # Remember the stop request if it arrived in the middle of a batch
+        return batch, job is None
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def _update_loading_progress(self, progress):
+        self.loading_progress = progress
+
+    def _load(self):
+        try:
+            self.image_generator = self.create_generator(self._update_loading_progress)
+        except Exception as e:
+            print(f"Error: Could not load the image generator: {e}")
+            self.load_error = e
+        self.ready_time = time.time()
+        self.ready.set()
+
+    def _run(self):
+        if not self.ready.is_set():
+            self._load()
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if not batch:
+                continue
+            try:
+                if self.image_generator is None:
+                    raise self.load_error
+                if len(batch) == 1:
+                    job = batch[0]
+                    results = [
+                        self.image_generator.generate(
+                            self._job_image(job),
+                            job.forced_prompt,
+                            job.update_progress,
+                            job.token,
+                        )
+                    ]
+                else:
+                    results = self.image_generator.generate_batch(
+                        [
+                            (
+                                self._job_image(job),
+                                job.forced_prompt,
+                                job.update_progress,
+                                job.token,
+                            )
+                            for job in batch
+                        ]
+                    )
+            except GenerationCancelled:
+                results = [None] * len(batch)
+            except Exception as e:
+                for job in batch:
+                    print(f"Error: Generation failed for {job.name}: {e}")
+                    job.set_error(e)
+                continue
+
+            for job, result in zip(batch, results):
+                if job.token.cancelled():
+                    self._record_cancel(job)
+                else:
+                    job.set_result(result)
+
+    def _record_cancel(self, job):
+        job.token.observe()
+        latency = job.token.latency()
+        self.cancel_latencies.append(latency)
+        metrics.record("cancel", latency, job=job.name)
+        print(f"Generation for {job.name} cancelled in {latency * 1000:.0f} ms")
+
+    def cancel_latency(self):
+        latencies = sorted(self.cancel_latencies)
+        if not latencies:
+            return {"count": 0, "mean": None, "p95": None, "max": None}
+        return {
+            "count": len(latencies),
+            "mean": sum(latencies) / len(latencies),
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+        }
+
+    def stop(self):
+        try:
+            self.jobs.put_nowait(None)
+        except queue.Full:
+            pass  # The thread is a daemon, it goes away with the process
+        self.thread.join(timeout=1)
+        self.preprocessor.shutdown(wait=False, cancel_futures=True)